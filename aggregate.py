@@ -0,0 +1,307 @@
+import fcntl
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from snapshot import NAT_DAY, Snapshot
+
+
+# 時系列の間引きの幅（日）と、1系列あたりの点数の目安
+LOD_WIDTHS = [1, 7, 28]
+MAX_POINTS = 400
+
+
+class CountCube:
+    """
+    日付×年代の感染者数を持つ密な整数行列
+    起動時（データ更新時）に一度だけ作成し、日付ごとの集計は行の参照だけで返す
+
+    Attributes:
+        counts: np.ndarray (日数, 年代数) の感染者数
+        totals: np.ndarray 日付ごとの合計（年代不明の行も含む）
+        start: pd.Timestamp counts の0行目の日付
+        ages: pd.Index 列に対応する年代
+    """
+
+    def __init__(
+        self, counts: np.ndarray, totals: np.ndarray, start: pd.Timestamp, ages: pd.Index
+    ):
+        self.counts = counts
+        self.totals = totals
+        self.start = pd.Timestamp(start)
+        self.ages = pd.Index(ages)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "CountCube":
+        """
+        date, age 列を持つデータフレームから行列を作成する
+        """
+        days = df["date"].to_numpy(dtype="datetime64[D]")
+        valid_day = ~np.isnat(days)
+        age_codes, ages = pd.factorize(df["age"], sort=True)
+        return cls.from_codes(days.astype(np.int64), valid_day, age_codes, ages)
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Snapshot) -> "CountCube":
+        """
+        スナップショットの整数列から、日付の変換をせずに行列を作成する
+        """
+        days = np.asarray(snapshot.columns["date"])
+        ages = pd.Index(snapshot.categories["age"])
+        return cls.from_codes(days, days != NAT_DAY, snapshot.columns["age"], ages)
+
+    @classmethod
+    def from_codes(
+        cls,
+        days: np.ndarray,
+        valid_day: np.ndarray,
+        age_codes: np.ndarray,
+        ages: pd.Index,
+    ) -> "CountCube":
+        """
+        整数にした列から行列を作成する
+        Params:
+            days: 1970-01-01 からの日数
+            valid_day: 日付が欠損していない行
+            age_codes: 年代のコード（欠損は -1）
+            ages: コードに対応する年代
+        """
+        day_codes = days[valid_day].astype(np.int64)
+        first = day_codes.min()
+        day_codes -= first
+        n_days = day_codes.max() + 1
+        totals = np.bincount(day_codes, minlength=n_days)
+
+        age_codes = np.asarray(age_codes)[valid_day].astype(np.int64)
+        valid = age_codes >= 0
+        flat = day_codes[valid] * len(ages) + age_codes[valid]
+        counts = np.bincount(flat, minlength=n_days * len(ages))
+        counts = counts.reshape(n_days, len(ages))
+
+        start = pd.Timestamp(np.datetime64(int(first), "D"))
+        return cls(counts.astype(np.int32), totals.astype(np.int32), start, ages)
+
+    def save(self, path: str) -> None:
+        """
+        行列を .npy として書き出す（attach で読み取り専用で共有するため）
+        """
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "counts.npy"), self.counts)
+        np.save(os.path.join(tmp_path, "totals.npy"), self.totals)
+        meta = {"start": self.start.isoformat(), "ages": [str(a) for a in self.ages]}
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def attach(cls, path: str) -> "CountCube":
+        """
+        save で書き出した行列をメモリマップ（読み取り専用）で開く
+        同じファイルを開いたプロセス間では物理メモリが共有される
+        """
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        counts = np.load(os.path.join(path, "counts.npy"), mmap_mode="r")
+        totals = np.load(os.path.join(path, "totals.npy"), mmap_mode="r")
+        return cls(counts, totals, pd.Timestamp(meta["start"]), pd.Index(meta["ages"]))
+
+    @property
+    def dates(self) -> pd.DatetimeIndex:
+        return pd.date_range(self.start, periods=len(self.counts), freq="D")
+
+    @property
+    def min_date(self) -> pd.Timestamp:
+        return self.start
+
+    @property
+    def max_date(self) -> pd.Timestamp:
+        return self.start + pd.Timedelta(days=len(self.counts) - 1)
+
+    def _row(self, selected_date: datetime) -> int:
+        return (pd.Timestamp(selected_date).normalize() - self.start).days
+
+    def rows(self, start_date: datetime, end_date: datetime) -> Tuple[int, int]:
+        """
+        start_date から end_date まで（両端を含む）の行の範囲を、データのある期間に収めて返す
+        期間が重ならなければ lo > hi になる
+        """
+        lo = max(self._row(start_date), 0)
+        hi = min(self._row(end_date), len(self.counts) - 1)
+        return lo, hi
+
+    def age_frame(self, values: np.ndarray) -> pd.DataFrame:
+        """
+        年代ごとの感染者数を、0件の年代を除き多い順に並べたデータフレームにする
+        """
+        nonzero = np.flatnonzero(values)
+        order = nonzero[np.argsort(-values[nonzero], kind="stable")]
+        return pd.DataFrame({"age": self.ages[order], "counts": values[order]})
+
+    def day_counts(self, selected_date: datetime) -> Tuple[pd.DataFrame, int]:
+        """
+        選択された日付の年代別感染者数と、その日の合計を返す
+        """
+        row = self._row(selected_date)
+        if row < 0 or row >= len(self.counts):
+            return pd.DataFrame({"age": [], "counts": []}), 0
+        return self.age_frame(self.counts[row]), int(self.totals[row])
+
+    def aged_frame(self) -> pd.DataFrame:
+        """
+        日付、年代ごとの感染者数（0件の組み合わせは含まない）
+        """
+        rows, cols = np.nonzero(self.counts)
+        return pd.DataFrame(
+            {
+                "date": self.dates[rows],
+                "age": self.ages[cols],
+                "counts": self.counts[rows, cols],
+            }
+        )
+
+    def all_frame(self) -> pd.DataFrame:
+        """
+        日付ごとの合計感染者数（感染者のいない日は含まない）
+        """
+        rows = np.flatnonzero(self.totals)
+        return pd.DataFrame({"date": self.dates[rows], "counts": self.totals[rows]})
+
+
+def shared_cube(
+    shared_dir: str, version: str, build: Callable[[], CountCube]
+) -> CountCube:
+    """
+    プロセス間で共有する行列を返す
+    shared_dir/version に書き出し済みであればそれを開き、なければ作成して書き出す
+    作成はロックを取った1プロセス（--preload の master か最初のワーカー）だけが行い、
+    他のプロセスは書き出されたものを開くだけになる
+
+    Params:
+        shared_dir: 共有する行列を置くディレクトリ
+        version: データのバージョン
+        build: 行列を作成する関数
+    Returns:
+        cube: メモリマップされた読み取り専用の行列
+    """
+    os.makedirs(shared_dir, exist_ok=True)
+    path = os.path.join(shared_dir, version)
+    with open(os.path.join(shared_dir, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(path):
+                build().save(path)
+                # 古いバージョンは削除する（開いているプロセスのマップはそのまま残る）
+                for name in os.listdir(shared_dir):
+                    if name not in (version, ".lock"):
+                        shutil.rmtree(os.path.join(shared_dir, name), ignore_errors=True)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return CountCube.attach(path)
+
+
+def choose_width(n_days: int, max_points: int = MAX_POINTS) -> int:
+    """
+    n_days 日分を max_points 点以内で表示できる、最も細かい間引きの幅を返す
+    """
+    for width in LOD_WIDTHS:
+        points = n_days if width == 1 else 2 * -(-n_days // width)
+        if points <= max_points:
+            return width
+    return LOD_WIDTHS[-1]
+
+
+def minmax_downsample(values: np.ndarray, width: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    系列を width 日ごとに区切り、各区間の最小値と最大値の点（と最初と最後の点）だけを残す
+    山や谷の高さは間引いても変わらない
+    Returns:
+        idx: 残した点の日付の番号
+        values: 残した点の値
+    """
+    values = np.asarray(values)
+    n = len(values)
+    if width <= 1 or n <= 2:
+        return np.arange(n), values
+    pad = (-n) % width
+    blocks = np.pad(values, (0, pad), mode="edge").reshape(-1, width)
+    starts = np.arange(0, n, width)
+    idx = np.concatenate(
+        [
+            [0, n - 1],
+            np.minimum(starts + blocks.argmin(axis=1), n - 1),
+            np.minimum(starts + blocks.argmax(axis=1), n - 1),
+        ]
+    )
+    idx = np.unique(idx)
+    return idx, values[idx]
+
+
+class LevelOfDetail:
+    """
+    日別の系列（列ごと）を、LOD_WIDTHS の幅で間引いたものをあらかじめ持っておく
+    表示する範囲が広ければ粗いもの、狭ければ日別のものを返す
+
+    Params:
+        series: (日数, 系列数) の配列
+    """
+
+    def __init__(self, series: np.ndarray):
+        self.series = np.asarray(series)
+        self.levels = {
+            width: [
+                minmax_downsample(self.series[:, j], width)
+                for j in range(self.series.shape[1])
+            ]
+            for width in LOD_WIDTHS[1:]
+        }
+
+    @property
+    def n_days(self) -> int:
+        return len(self.series)
+
+    def window(self, j: int, lo: int, hi: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        j 番目の系列の lo 日目から hi 日目まで（両端を含む）を、範囲の広さに合う幅で返す
+        """
+        lo, hi = max(lo, 0), min(hi, self.n_days - 1)
+        width = choose_width(hi - lo + 1)
+        if width == 1:
+            return np.arange(lo, hi + 1), self.series[lo : hi + 1, j]
+        idx, values = self.levels[width][j]
+        mask = (idx >= lo) & (idx <= hi)
+        return idx[mask], values[mask]
+
+    def view(
+        self, j: int, window: Optional[Tuple[int, int]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        全期間を粗く、window の範囲だけを細かくした j 番目の系列
+        window がなければ全期間を粗くしたもの
+        """
+        idx, values = self.window(j, 0, self.n_days - 1)
+        if window is None:
+            return idx, values
+        lo, hi = window
+        detail_idx, detail_values = self.window(j, lo, hi)
+        outside = (idx < lo) | (idx > hi)
+        idx = np.concatenate([idx[outside], detail_idx])
+        values = np.concatenate([values[outside], detail_values])
+        order = np.argsort(idx, kind="stable")
+        return idx[order], values[order]
+
+    def payload(self, names: List[str], window: Optional[Tuple[int, int]] = None) -> Dict:
+        """
+        系列ごとの日付の番号と値を、ブラウザに送るための辞書にする
+        """
+        views = [self.view(j, window) for j in range(len(names))]
+        return {
+            "names": names,
+            "x": [idx.tolist() for idx, _ in views],
+            "counts": [values.tolist() for _, values in views],
+        }
@@ -0,0 +1,136 @@
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from aggregate import CountCube
+
+WINDOW = 7
+
+
+class RollingStats:
+    """
+    日付×年代の感染者数から、7日間移動平均、前週比、年代別割合（7日間）を計算したもの
+    累積和から区間の合計を出すので、どの指標も全期間をまとめて計算できる
+    データが増えた場合は updated で変わった日以降だけを計算し直す
+
+    Attributes:
+        cum_counts: (日数+1, 年代数) 年代別感染者数の累積和（0行目は0）
+        cum_totals: (日数+1,) 合計感染者数の累積和
+        ma7: 合計感染者数の7日間移動平均（最初の6日は NaN）
+        growth: 7日間の合計の前週比（1.0 で前週と同じ。前週が0なら NaN）
+        share: (日数, 年代数) 7日間の年代別割合
+    """
+
+    def __init__(
+        self,
+        cum_counts: np.ndarray,
+        cum_totals: np.ndarray,
+        previous: "RollingStats" = None,
+        first: int = 0,
+    ):
+        """
+        previous を指定した場合、first 日目より前の指標は previous のものを使う
+        """
+        self.cum_counts = cum_counts
+        self.cum_totals = cum_totals
+        n_days = len(cum_totals) - 1
+        self.ma7 = np.full(n_days, np.nan)
+        self.growth = np.full(n_days, np.nan)
+        self.share = np.full((n_days, cum_counts.shape[1]), np.nan)
+        if previous is not None:
+            self.ma7[:first] = previous.ma7[:first]
+            self.growth[:first] = previous.growth[:first]
+            self.share[:first] = previous.share[:first]
+        self._compute(first)
+
+    @classmethod
+    def from_cube(cls, cube: CountCube) -> "RollingStats":
+        return cls(_cumsum(cube.counts), _cumsum(cube.totals))
+
+    def __len__(self) -> int:
+        return len(self.cum_totals) - 1
+
+    def _window_sum(self, cum: np.ndarray, days: np.ndarray, lag: int = 0) -> np.ndarray:
+        """
+        days の各日（から lag 日前）を最終日とする7日間の合計。7日に満たなければ NaN
+        """
+        end = days - lag + 1
+        begin = end - WINDOW
+        valid = begin >= 0
+        sums = np.full((len(days),) + cum.shape[1:], np.nan)
+        sums[valid] = cum[end[valid]] - cum[begin[valid]]
+        return sums
+
+    def _compute(self, first: int) -> None:
+        """
+        first 日目以降の指標を計算する
+        """
+        days = np.arange(first, len(self))
+        week = self._window_sum(self.cum_totals, days)
+        last_week = self._window_sum(self.cum_totals, days, lag=WINDOW)
+        week_aged = self._window_sum(self.cum_counts, days)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.ma7[first:] = week / WINDOW
+            self.growth[first:] = np.where(last_week > 0, week / last_week, np.nan)
+            self.share[first:] = np.where(
+                week[:, None] > 0, week_aged / week[:, None], np.nan
+            )
+
+    def updated(self, cube: CountCube) -> "RollingStats":
+        """
+        新しい集計行列に合わせた指標を返す
+        以前と同じ日付から始まり年代も同じであれば、値が変わった日以降だけを計算する
+        """
+        n_old = len(self)
+        old_counts = np.diff(self.cum_counts, axis=0)
+        old_totals = np.diff(self.cum_totals)
+        if len(cube.counts) < n_old or cube.counts.shape[1] != old_counts.shape[1]:
+            return RollingStats.from_cube(cube)
+        changed = (np.asarray(cube.counts[:n_old]) != old_counts).any(axis=1) | (
+            np.asarray(cube.totals[:n_old]) != old_totals
+        )
+        first = int(np.argmax(changed)) if changed.any() else n_old
+
+        cum_counts = np.concatenate(
+            [
+                self.cum_counts[: first + 1],
+                self.cum_counts[first] + _cumsum(cube.counts[first:])[1:],
+            ]
+        )
+        cum_totals = np.concatenate(
+            [
+                self.cum_totals[: first + 1],
+                self.cum_totals[first] + _cumsum(cube.totals[first:])[1:],
+            ]
+        )
+        return RollingStats(cum_counts, cum_totals, previous=self, first=first)
+
+    def range_sum(self, lo: int, hi: int) -> Tuple[np.ndarray, int]:
+        """
+        lo 日目から hi 日目まで（両端を含む）の年代別の合計と、全体の合計
+        累積和の差を取るだけなので、期間の長さによらず年代数に比例する時間で済む
+        """
+        if lo > hi:
+            return np.zeros(self.cum_counts.shape[1], dtype=np.int64), 0
+        counts = self.cum_counts[hi + 1] - self.cum_counts[lo]
+        return counts, int(self.cum_totals[hi + 1] - self.cum_totals[lo])
+
+    def share_frame(self, start: pd.Timestamp, ages: pd.Index) -> pd.DataFrame:
+        """
+        年代別割合を date, age, counts の縦長のデータフレームにする（draw_line 用）
+        """
+        dates = pd.date_range(start, periods=len(self), freq="D")
+        df = pd.DataFrame(self.share, index=dates, columns=ages)
+        df = df.rename_axis("date").reset_index()
+        return df.melt(id_vars="date", var_name="age", value_name="counts").dropna()
+
+
+def _cumsum(values: np.ndarray) -> np.ndarray:
+    """
+    先頭に0の行を付けた累積和
+    """
+    values = np.asarray(values, dtype=np.int64)
+    zero = np.zeros((1,) + values.shape[1:], dtype=np.int64)
+    return np.concatenate([zero, np.cumsum(values, axis=0)])
+
@@ -1,23 +1,57 @@
+import time
+
+START_TIME = time.time()
+
 from pandas.core.indexes import multi
 import dash
 import dash_html_components as html
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
-import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
-from dash.dependencies import Input, Output, State
+import numpy as np
+import bundle
+import export
+from dash.dependencies import ClientsideFunction, Input, Output, State
+
+from aggregate import CountCube, LevelOfDetail, shared_cube
+from analytics import RollingStats
+from data_store import DataStore, data_version
+from figure_cache import FigureCache
+from metrics import Metrics, install as install_metrics
+from regions import Region, RegionStores, load_regions
+from response_cache import code_version, install as install_response_cache, make_store
+from snapshot import load_snapshot, snapshot_path
+from static_figures import StaticFigure, compress_figure, figure_response
+from vaccine_store import FORECAST_DTYPES, SESHU_DTYPES, VaccineTable
+from flask import Response, abort, jsonify, request
 
 from datetime import date
 from datetime import datetime
 import os
-import time
+from functools import partial
+from typing import NamedTuple, Optional, Tuple
+
+
+def _px():
+    """
+    plotly.express は import に時間がかかるので、最初にグラフを作る時に読み込む
+    """
+    import plotly.express as px
 
+    return px
 
-def draw_circle(df: pd.DataFrame, total: int, today: str) -> go.Figure:
+
+def draw_circle(
+    df: pd.DataFrame, total: int, today: str, until: Optional[datetime] = None
+) -> go.Figure:
     """
     年代別患者数の円グラフを作成する関数
+    until を指定すると today から until までの期間の集計として題を付ける
     """
+    title = f"{today.date()}"
+    if until is not None and until.date() != today.date():
+        title = f"{today.date()} ～ {until.date()}"
     fig = go.Figure()
     circle_size = 400
     fig.add_trace(
@@ -28,7 +62,7 @@ def draw_circle(df: pd.DataFrame, total: int, today: str) -> go.Figure:
     fig.update_layout(
         width=circle_size,
         height=circle_size,
-        title={"text": f"{today.date()}", "x": 0.47, "xanchor": "center"},
+        title={"text": title, "x": 0.47, "xanchor": "center"},
         annotations=[
             {"text": f"感染者数: {str(total)}", "showarrow": False, "font_size": 25}
         ],
@@ -39,34 +73,57 @@ def draw_circle(df: pd.DataFrame, total: int, today: str) -> go.Figure:
     return fig
 
 
-def cal_counts(df: pd.DataFrame, selected_date: datetime) -> pd.DataFrame:
+def cal_counts(cube: CountCube, selected_date: datetime) -> pd.DataFrame:
     """
     選択された日付のデータを集計したものを出力
     その日の感染者数の合計も返す
     """
-    selected_df = df[df["date"] == selected_date]
-    counts = pd.DataFrame(selected_df["age"].value_counts())
-    counts.columns = ["counts"]
-    counts = counts.reset_index()
-    counts = counts.rename({"index": "age"}, axis=1)
+    return cube.day_counts(selected_date)
 
-    total = len(selected_df)
-    return counts, total
 
+def cal_range_counts(
+    cube: CountCube, stats: RollingStats, start_date: datetime, end_date: datetime
+) -> Tuple[pd.DataFrame, int]:
+    """
+    start_date から end_date まで（両端を含む）の年代別感染者数と合計を返す
+    累積和の差から求めるので、期間の長さによらない
+    """
+    lo, hi = cube.rows(start_date, end_date)
+    counts, total = stats.range_sum(lo, hi)
+    return cube.age_frame(counts), total
 
-df = pd.read_csv("data/kyoto_patients.csv", parse_dates=["date"], index_col=0)
-new_date = df["date"].max()
-min_date = df["date"].min()
-new_counts, new_total = cal_counts(df, new_date)
 
-## データ全てを年齢と日付で分けたもの
-aged_df = pd.DataFrame(df[["date", "age"]].value_counts())
-aged_df.columns = ["counts"]
-aged_df = aged_df.reset_index()
+def parse_date(value: str) -> datetime:
+    """
+    日付選択の値（YYYY-MM-DD、時刻が付くこともある）を datetime にする
+    """
+    return datetime.strptime(value[:10], "%Y-%m-%d")
+
 
+DATA_PATH = os.environ.get("DATA_PATH", "data/kyoto_patients.csv")
+## 配送数（vac_forecast.csv）は接種数と同じディレクトリ（バンドル）から読み込む
+VACCINE_PATH = "./data/vaccined_num.csv"
+## 指定すると ingest.py が公開したバンドル（CURRENT が指すもの）からデータを読み込む
+DATA_BUNDLE_DIR = os.environ.get("DATA_BUNDLE_DIR")
+if DATA_BUNDLE_DIR:
+    DATA_PATH = VACCINE_PATH = os.path.join(DATA_BUNDLE_DIR, bundle.CURRENT)
+## 指定すると集計行列をこのディレクトリに書き出し、各ワーカーはメモリマップで共有する
+SHARED_DATA_DIR = os.environ.get("SHARED_DATA_DIR")
+## 指定するとこのディレクトリの下の地域ごとのデータ（<地域名>/patients.csv）を切り替えて表示する
+REGIONS_DIR = os.environ.get("REGIONS_DIR")
+if REGIONS_DIR:
+    REGIONS = load_regions(REGIONS_DIR)
+else:
+    REGIONS = {"kyoto": Region("kyoto", "京都府", DATA_PATH)}
+DEFAULT_REGION = os.environ.get("DEFAULT_REGION") or next(iter(REGIONS))
+## コールバックやデータの読み込みの処理時間（/metrics で公開する）
+metrics = Metrics()
+## コードのバージョン。グラフの ETag とキャッシュのキーに含め、デプロイでグラフの描き方が変わったら作り直す
+CODE_VERSION = code_version(os.path.dirname(os.path.abspath(__file__)))
 
-def draw_line(df: pd.DataFrame, graph_type = px.line, color='age'):
-    aged_fig = graph_type(df, x="date", y="counts", color=color)
+
+def draw_line(df: pd.DataFrame, graph_type: str = "line", color='age'):
+    aged_fig = getattr(_px(), graph_type)(df, x="date", y="counts", color=color)
     aged_fig.update_layout(
         xaxis=dict(
             rangeselector=dict(
@@ -87,16 +144,24 @@ def draw_line(df: pd.DataFrame, graph_type = px.line, color='age'):
     )
     return aged_fig
 
-all_df = pd.DataFrame(df[['date', 'age']].groupby('date').size())
-all_df.columns = ['counts']
-all_df = all_df.reset_index()
-total_graph = draw_line(all_df, graph_type=px.line, color=None)
 
 def recent_pcr_graph(
-    df: pd.DataFrame, x_axis_name: str, y_axis_name: str, title: str = None, selector: str = 'bar'
+    df: pd.DataFrame,
+    x_axis_name: str,
+    y_axis_name: str,
+    title: str = None,
+    selector: str = 'bar',
+    latest: Optional[pd.DataFrame] = None,
 ) -> go.Figure:
-    recent_date = df["date"].max()
-    graph_df = df[df["date"] == recent_date]
+    """
+    棒グラフは最新の日付のデータで作る。latest を渡せばそれを使い、df から探さない
+    """
+    px = _px()
+    if latest is not None:
+        graph_df = latest
+    else:
+        recent_date = df["date"].max()
+        graph_df = df[df["date"] == recent_date]
     if selector == 'bar':
         fig = px.bar(graph_df, x=x_axis_name, y=y_axis_name, title=title, height=450)
     elif selector=='line':
@@ -105,17 +170,291 @@ def recent_pcr_graph(
     return fig
 
 
-new_fig = draw_circle(new_counts, new_total, new_date)
+def lod_frame(
+    lod: LevelOfDetail,
+    start: pd.Timestamp,
+    j: int = 0,
+    window: Optional[Tuple[int, int]] = None,
+) -> pd.DataFrame:
+    """
+    間引いた系列を draw_line に渡せるデータフレームにする
+    """
+    idx, values = lod.view(j, window)
+    return pd.DataFrame(
+        {"date": start + pd.to_timedelta(idx, unit="D"), "counts": values}
+    )
+
+
+def relayout_window(relayout: dict, start: pd.Timestamp) -> Optional[Tuple[int, int]]:
+    """
+    relayoutData から表示されている日付の範囲（start からの日数。両端を含む）を取り出す
+    LevelOfDetail.window とブラウザ側（aged.update_line）も両端を含む範囲として扱う
+    全期間の表示に戻された場合は None、範囲の変更でなければ PreventUpdate
+    """
+    if not relayout:
+        raise dash.exceptions.PreventUpdate
+    if relayout.get("xaxis.autorange"):
+        return None
+    if "xaxis.range[0]" in relayout:
+        lo, hi = relayout["xaxis.range[0]"], relayout["xaxis.range[1]"]
+    elif "xaxis.range" in relayout:
+        lo, hi = relayout["xaxis.range"]
+    else:
+        raise dash.exceptions.PreventUpdate
+    lo = (pd.Timestamp(lo) - start).days
+    hi = (pd.Timestamp(hi) - start).days
+    return lo, hi
+
+
+class PatientData(NamedTuple):
+    """
+    感染者データから作る集計結果一式。データファイルが更新されると丸ごと差し替える
+    """
+
+    version: str
+    cube: CountCube
+    aged_lod: LevelOfDetail
+    aged_series: dict
+    total_lod: LevelOfDetail
+    new_date: pd.Timestamp
+    min_date: pd.Timestamp
+    total_graph: StaticFigure
+    new_fig: go.Figure
+    stats: RollingStats
+    analytics_graphs: dict
+
+
+def load_cube(path: str) -> CountCube:
+    """
+    日付×年代の集計行列を作る
+    CSVと同じ内容のスナップショットがあればそちらを使う
+    """
+    snapshot = load_snapshot(snapshot_path(path), csv_path=path)
+    if snapshot is not None:
+        return CountCube.from_snapshot(snapshot)
+    df = pd.read_csv(path, parse_dates=["date"], index_col=0)
+    return CountCube.from_frame(df)
+
+
+## 移動平均などのグラフ（名前, 見出し）
+ANALYTICS_GRAPHS = [
+    ("ma7", "合計感染者数（7日間移動平均）"),
+    ("growth", "前週比（7日間の合計）"),
+    ("share", "年代別割合の推移（7日間）"),
+]
+
+
+def draw_analytics(stats: RollingStats, cube: CountCube) -> dict:
+    """
+    移動平均、前週比、年代別割合のグラフを作る
+    """
+    dates = pd.date_range(cube.start, periods=len(stats), freq="D")
+    ma7 = pd.DataFrame({"date": dates, "counts": stats.ma7}).dropna()
+    growth = pd.DataFrame({"date": dates, "counts": stats.growth}).dropna()
+    figs = {
+        "ma7": draw_line(ma7, graph_type="line", color=None),
+        "growth": draw_line(growth, graph_type="line", color=None),
+        "share": draw_line(stats.share_frame(cube.start, cube.ages), graph_type="area"),
+    }
+    figs["growth"].add_hline(y=1, line_dash="dot")
+    figs["share"].update_layout(showlegend=True, yaxis_tickformat=".0%")
+    return figs
+
+
+def build_patient_data(
+    path: str,
+    version: str,
+    previous: Optional[PatientData] = None,
+    shared_dir: Optional[str] = None,
+) -> PatientData:
+    """
+    shared_dir を指定すると、集計行列をそこに書き出してワーカー間で共有する
+    """
+    ## 日付×年代の集計行列。日付ごとの集計、時系列データはここから作る
+    path = bundle.resolve(path, "kyoto_patients.csv")
+    with metrics.timer("patient.cube"):
+        if shared_dir:
+            cube = shared_cube(shared_dir, version, lambda: load_cube(path))
+        else:
+            cube = load_cube(path)
+    new_date = cube.max_date
+    min_date = cube.min_date
+    with metrics.timer("patient.filter"):
+        new_counts, new_total = cal_counts(cube, new_date)
+
+    ## データ全てを年齢と日付で分けたもの（ブラウザ側でグラフにする）
+    ## 全期間は間引いたものを送り、拡大された範囲だけ細かいものを送る
+    with metrics.timer("patient.series"):
+        aged_lod = LevelOfDetail(cube.counts)
+        aged_series = {
+            "start": cube.start.strftime("%Y-%m-%d"),
+            **aged_lod.payload([str(age) for age in cube.ages]),
+        }
+        total_lod = LevelOfDetail(np.asarray(cube.totals)[:, None])
+    with metrics.timer("patient.figure"):
+        total_fig = draw_line(lod_frame(total_lod, cube.start), graph_type="line", color=None)
+        total_fig.update_layout(uirevision="total")
+        new_fig = draw_circle(new_counts, new_total, new_date)
+    with metrics.timer("patient.serialize"):
+        total_graph = compress_figure(total_fig, version, "total", CODE_VERSION)
+
+    ## 移動平均などは、前のデータと同じ日付から始まっていれば変わった日以降だけ計算する
+    with metrics.timer("patient.analytics"):
+        if (
+            previous is not None
+            and previous.cube.start == cube.start
+            and previous.cube.ages.equals(cube.ages)
+        ):
+            stats = previous.stats.updated(cube)
+        else:
+            stats = RollingStats.from_cube(cube)
+        analytics_figs = draw_analytics(stats, cube)
+    with metrics.timer("patient.serialize"):
+        analytics_graphs = {
+            name: compress_figure(fig, version, name, CODE_VERSION)
+            for name, fig in analytics_figs.items()
+        }
+    return PatientData(
+        version,
+        cube,
+        aged_lod,
+        aged_series,
+        total_lod,
+        new_date,
+        min_date,
+        total_graph,
+        new_fig,
+        stats,
+        analytics_graphs,
+    )
+
+
+class VaccineData(NamedTuple):
+    """
+    ワクチンの接種数、配送数のデータ
+    """
+
+    version: str
+    seshu_data: pd.DataFrame
+    seshu_latest: pd.DataFrame
+    latest_seshu_date: str
+    deliv_data: pd.DataFrame
+    deliv_latest: pd.DataFrame
+    deliv_graph: StaticFigure
+
+
+def vaccine_files(path: str) -> Tuple[str, str]:
+    """
+    接種数と配送数のファイル。path がバンドルの CURRENT なら現在のバンドルの中のもの、
+    そうでなければ接種数のファイルと同じディレクトリの vac_forecast.csv
+    """
+    if os.path.basename(path) == bundle.CURRENT:
+        return bundle.resolve(path, "vaccined_num.csv"), bundle.resolve(path, "vac_forecast.csv")
+    return path, os.path.join(os.path.dirname(path), "vac_forecast.csv")
+
+
+def vaccine_version(path: str) -> str:
+    """
+    接種数と配送数の両方のファイルから作るバージョン（配送数だけが更新されることもある）
+    """
+    return "-".join(data_version(p) for p in vaccine_files(path))
+
+
+def build_vaccine_data(
+    path: str, version: str, previous: Optional[VaccineData] = None
+) -> VaccineData:
+    seshu_path, deliv_path = vaccine_files(path)
+    ## 最新の日付のデータは索引から直接読み込む（配送数の全ての日付のデータは書き出しにだけ使う）
+    with metrics.timer("vaccine.read"):
+        seshu_table = VaccineTable(seshu_path, SESHU_DTYPES)
+        seshu_data = seshu_table.load()
+        seshu_latest = seshu_table.snapshot()
+        latest_seshu_date = seshu_table.latest_date
 
-deliv_data = pd.read_csv("./data/vac_forecast.csv")
-latest_deliv_date = max(deliv_data['date'])
-deliv_graph = recent_pcr_graph(
-    deliv_data, x_axis_name="配送期間", y_axis_name="配送数（予定を含む）", title=f"ワクチン配送数: （{latest_deliv_date}時点）"
+        deliv_table = VaccineTable(deliv_path, FORECAST_DTYPES)
+        deliv_data = deliv_table.load()
+        deliv_latest = deliv_table.snapshot()
+        latest_deliv_date = deliv_table.latest_date
+    with metrics.timer("vaccine.figure"):
+        deliv_graph = recent_pcr_graph(
+            deliv_latest, x_axis_name="配送期間", y_axis_name="配送数（予定を含む）", title=f"ワクチン配送数: （{latest_deliv_date}時点）", latest=deliv_latest
+        )
+    with metrics.timer("vaccine.serialize"):
+        deliv_static = compress_figure(deliv_graph, version, "deliv", CODE_VERSION)
+    return VaccineData(
+        version,
+        seshu_data,
+        seshu_latest,
+        latest_seshu_date,
+        deliv_data,
+        deliv_latest,
+        deliv_static,
+    )
+
+
+## 指定するとデータの読み込みをバックグラウンドで行い、その間は読み込み中の画面を返す
+LAZY_START = os.environ.get("LAZY_START") == "1"
+
+
+
+def region_build(region: Region):
+    """
+    地域の集計を作る関数（共有する集計行列は地域ごとのディレクトリに置く）
+    """
+    shared_dir = os.path.join(SHARED_DATA_DIR, region.name) if SHARED_DATA_DIR else None
+    return partial(build_patient_data, shared_dir=shared_dir)
+
+
+## データファイルの更新を監視し、更新されたら集計をやり直して差し替える
+## 既定の地域は起動時に読み込み、それ以外の地域は最初に選ばれた時に読み込む
+store = DataStore(
+    REGIONS[DEFAULT_REGION].path,
+    region_build(REGIONS[DEFAULT_REGION]),
+    interval=float(os.environ.get("DATA_CHECK_SEC", 60)),
+    lazy=LAZY_START,
+)
+region_stores = RegionStores(
+    REGIONS,
+    region_build,
+    max_regions=int(os.environ.get("REGION_CACHE_SIZE", 4)),
+    interval=float(os.environ.get("DATA_CHECK_SEC", 60)),
+    pinned={DEFAULT_REGION: store},
 )
+vaccine_store = DataStore(
+    VACCINE_PATH,
+    build_vaccine_data,
+    interval=float(os.environ.get("DATA_CHECK_SEC", 60)),
+    lazy=LAZY_START,
+    version_of=vaccine_version,
+)
+
+
+def region_store(region: Optional[str] = None) -> Optional[DataStore]:
+    """
+    地域の DataStore（設定されていない地域なら None）
+    """
+    if not region or region == DEFAULT_REGION:
+        return store
+    if region not in region_stores:
+        return None
+    return region_stores.get(region)
+
+
+def current_data(region: Optional[str] = None) -> PatientData:
+    """
+    最新の集計結果。読み込み中であればコールバックを更新しない
+    """
+    data_store = region_store(region)
+    data = None if data_store is None else data_store.current
+    if data is None:
+        raise dash.exceptions.PreventUpdate
+    return data
 
 
-seshu_data = pd.read_csv("./data/vaccined_num.csv")
-latest_seshu_date = max(seshu_data['date'])
+def figure_path(name: str, region: Optional[str] = None) -> str:
+    if not region or region == DEFAULT_REGION:
+        return app.get_relative_path(f"/figures/{name}.json")
+    return app.get_relative_path(f"/figures/{region}/{name}.json")
 
 app = dash.Dash(
     __name__,
@@ -128,190 +467,586 @@ app = dash.Dash(
 
 server = app.server
 
-app.title = "京都府　年齢別コロナウィルス感染者数"
-contents = html.Div(
-    [
-        html.Div(
-            [
-                html.Div(
-                    [
-                        html.Div(
-                            [
-                                dcc.Graph(id="second_graph", style={"width": "95%"}),
-                                html.Div(
-                                    [
-                                        html.P(
-                                            "日付選択: ",
-                                            style={
-                                                "display": "inline-block",
-                                                "marginRight": "2%",
-                                                "fontSize": "1.2rem",
-                                            },
-                                        ),
-                                        dcc.DatePickerSingle(
-                                            id="datepicker",
-                                            min_date_allowed=min_date,
-                                            max_date_allowed=new_date,
-                                            initial_visible_month=date(2021, 7, 1),
-                                            date=date(
-                                                new_date.year,
-                                                new_date.month,
-                                                new_date.day,
+## 作成したグラフのキャッシュ。データファイルが変わると破棄される
+figure_cache = FigureCache(
+    int(os.environ.get("FIGURE_CACHE_MB", 64)) * 1024 * 1024, observe=metrics.observe
+)
+
+## /metrics（処理時間のヒストグラム）と、遅いリクエストのプロファイルの保存
+install_metrics(server, metrics)
+metrics.gauge("figure_cache", "Figure cache counters.", figure_cache.stats)
+metrics.gauge("regions", "Configured and loaded regions.", region_stores.stats)
+metrics.gauge(
+    "data_build_seconds",
+    "Time taken by the last data build.",
+    lambda: {
+        "patient": store.build_sec if store.build_sec is not None else float("nan"),
+        "vaccine": vaccine_store.build_sec
+        if vaccine_store.build_sec is not None
+        else float("nan"),
+    },
+)
+
+
+def callback_version(payload) -> Optional[Tuple[str, str]]:
+    """
+    コールバックのリクエストの地域（入力か State の region）と、その地域とワクチンのデータのバージョン
+    読み込み中なら None（キャッシュしない）
+    """
+    region = DEFAULT_REGION
+    for item in (payload.get("inputs") or []) + (payload.get("state") or []):
+        if isinstance(item, dict) and item.get("id") == "region" and item.get("value"):
+            region = item["value"]
+    data_store = region_store(region)
+    data = None if data_store is None else data_store.current
+    vaccine = vaccine_store.current
+    if data is None or vaccine is None:
+        return None
+    return region, f"{data.version}:{vaccine.version}"
+
+
+## コールバックのレスポンスのキャッシュ（RESPONSE_CACHE_DB を指定すると全てのワーカーで共有する）
+## クライアント側のコールバック（年代の選択など）はサーバーに来ないので対象外
+response_store = make_store()
+install_response_cache(
+    server,
+    response_store,
+    callback_version,
+    observe=metrics.observe,
+    app_version=CODE_VERSION,
+)
+metrics.gauge("response_cache", "Callback response cache counters.", response_store.stats)
+
+
+@server.route("/_figure-cache")
+def figure_cache_stats():
+    return jsonify(figure_cache.stats())
+
+
+@server.route("/figures/<name>.json")
+@server.route("/figures/<region>/<name>.json")
+def static_figure(name, region=None):
+    """
+    データのバージョンごとに変わらないグラフを、圧縮済みのJSONで返す（ETag 付き）
+    """
+    data_store = region_store(region)
+    if data_store is None:
+        abort(404)
+    # 配送数のグラフだけがワクチンのデータを使う（感染者のグラフはワクチンの読み込みを待たない）
+    data = vaccine_store.current if name == "deliv" else data_store.current
+    if data is None:
+        return Response(status=503, headers={"Retry-After": "1"})
+    if name == "deliv":
+        return figure_response(data.deliv_graph, request)
+    figures = {"total": data.total_graph, **data.analytics_graphs}
+    if name not in figures:
+        abort(404)
+    return figure_response(figures[name], request)
+
+
+@server.route("/api/age-counts")
+def age_counts_api():
+    """
+    期間（start, end。end を省略すると start の1日）の年代別感染者数と合計
+    日付が読めない、または start が end より後なら 400
+    region を指定するとその地域
+    """
+    data_store = region_store(request.args.get("region"))
+    if data_store is None:
+        abort(404)
+    data = data_store.current
+    if data is None:
+        return Response(status=503, headers={"Retry-After": "1"})
+    try:
+        start = parse_date(request.args.get("start", data.new_date.strftime("%Y-%m-%d")))
+        end = parse_date(request.args.get("end", start.strftime("%Y-%m-%d")))
+    except ValueError:
+        abort(400)
+    # 期間が逆のものは、感染者のいない期間（0件）と区別できるようにエラーにする
+    if start > end:
+        abort(400)
+    lo, hi = data.cube.rows(start, end)
+    counts, total = data.stats.range_sum(lo, hi)
+    return jsonify(
+        {
+            "version": data.version,
+            "start": start.strftime("%Y-%m-%d"),
+            "end": end.strftime("%Y-%m-%d"),
+            "total": total,
+            "counts": {str(age): int(n) for age, n in zip(data.cube.ages, counts)},
+        }
+    )
+
+
+@server.route("/export/<name>.<fmt>")
+def export_data(name, fmt):
+    """
+    集計済みのデータを CSV（fmt=csv）か Parquet（fmt=parquet。pyarrow がある場合のみ）で書き出す
+    counts: 日付×年代の感染者数（region を指定するとその地域）
+    seshu: ワクチンの接種数、deliv: ワクチンの配送数（全ての日付）
+    少しずつ作って返すので、大きなデータでもメモリに全体を置かない
+    """
+    if fmt not in ("csv", "parquet"):
+        abort(404)
+    if fmt == "parquet" and not export.parquet_available():
+        abort(406)
+    if name == "counts":
+        data_store = region_store(request.args.get("region"))
+        if data_store is None:
+            abort(404)
+        data = data_store.current
+        if data is None:
+            return Response(status=503, headers={"Retry-After": "1"})
+        version, frames = data.version, export.count_frames(data.cube)
+    elif name in ("seshu", "deliv"):
+        vaccine = vaccine_store.current
+        if vaccine is None:
+            return Response(status=503, headers={"Retry-After": "1"})
+        df = vaccine.seshu_data if name == "seshu" else vaccine.deliv_data
+        version, frames = vaccine.version, export.table_frames(df)
+    else:
+        abort(404)
+    if fmt == "csv":
+        body, mimetype = export.csv_chunks(frames), "text/csv"
+    else:
+        body, mimetype = export.parquet_chunks(frames), "application/vnd.apache.parquet"
+    return Response(
+        body,
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f"attachment; filename={name}.{fmt}",
+            "X-Data-Version": version,
+        },
+    )
+
+
+@server.route("/_ready")
+def ready():
+    """
+    データの読み込みが終わったか、起動にかかった時間（region を指定するとその地域）
+    """
+    data_store = region_store(request.args.get("region"))
+    if data_store is None:
+        abort(404)
+    return jsonify(
+        {
+            "ready": data_store.ready and vaccine_store.ready,
+            "build_sec": data_store.build_sec,
+            "first_response_sec": first_response_sec,
+        }
+    )
+
+
+## 起動から最初のレスポンスまでの時間
+first_response_sec = None
+
+
+@server.after_request
+def record_first_response(response):
+    global first_response_sec
+    if first_response_sec is None:
+        first_response_sec = time.time() - START_TIME
+        print(f"time to first response: {first_response_sec:.2f} sec")
+    return response
+
+
+def region_label(region: Optional[str] = None) -> str:
+    return REGIONS[region or DEFAULT_REGION].label
+
+
+## ページのタイトルは地域を切り替えるとブラウザ側で書き換える（assets/clientside.js）
+app.title = f"{region_label()}　年齢別コロナウィルス感染者数"
+
+
+def make_contents(data: PatientData, region: Optional[str] = None) -> html.Div:
+    new_date = data.new_date
+    label = region_label(region)
+    return html.Div(
+        [
+            html.Div(
+                [html.H1(f"{label}コロナウィルス感染者数"), html.H2("年代別割合")],
+                className="container pt-3 my-3 bg-primary text-white",
+                style={"textAlign": "center"},
+            ),
+            dcc.Store(id="page_title", data=f"{label}　年齢別コロナウィルス感染者数"),
+            html.Div(
+                [
+                    html.Div(
+                        [
+                            html.Div(
+                                [
+                                    dcc.Graph(id="second_graph", style={"width": "95%"}),
+                                    html.Div(
+                                        [
+                                            html.P(
+                                                "期間選択: ",
+                                                style={
+                                                    "display": "inline-block",
+                                                    "marginRight": "2%",
+                                                    "fontSize": "1.2rem",
+                                                },
                                             ),
-                                            display_format="YYYY/M/D",
-                                            style={
-                                                "display": "inline-block",
-                                                "verticalAlign": "middle",
-                                            },
-                                        ),
-                                    ],
-                                    style={"width": "50%", "margin": "5% auto"},
-                                ),
-                            ],
-                            className="first-row",
-                        ),
-                    ],
-                    className="first-parent",
-                ),
-            ],
-        ),
-        html.Div([
+                                            dcc.DatePickerRange(
+                                                id="datepicker",
+                                                min_date_allowed=data.min_date,
+                                                max_date_allowed=new_date,
+                                                initial_visible_month=date(2021, 7, 1),
+                                                start_date=date(
+                                                    new_date.year,
+                                                    new_date.month,
+                                                    new_date.day,
+                                                ),
+                                                end_date=date(
+                                                    new_date.year,
+                                                    new_date.month,
+                                                    new_date.day,
+                                                ),
+                                                minimum_nights=0,
+                                                display_format="YYYY/M/D",
+                                                style={
+                                                    "display": "inline-block",
+                                                    "verticalAlign": "middle",
+                                                },
+                                            ),
+                                        ],
+                                        style={"width": "70%", "margin": "5% auto"},
+                                    ),
+                                ],
+                                className="first-row",
+                            ),
+                        ],
+                        className="first-parent",
+                    ),
+                ],
+            ),
+            html.Div([
             
-            html.H3('合計感染者数（1日あたり）'),
-            dcc.Graph(figure=total_graph)
+                html.H3('合計感染者数（1日あたり）'),
+                dcc.Store(id="total_graph_src", data=figure_path("total", region)),
+                dcc.Graph(id="total_graph")
             
-            ],
-            className="time_series",
-            style={"padding": "3%"}
+                ],
+                className="time_series",
+                style={"padding": "3%"}
+                ),
+            html.Div(
+                [
+                    html.H3("年齢別感染者数（時系列）"),
+                    dcc.Dropdown(
+                        id="age_dropdown",
+                        options=[
+                            {"value": age, "label": age} for age in data.cube.ages
+                        ],
+                        multi=True,
+                        value=["10代未満", "10代"],
+                    ),
+                    dcc.Store(id="aged_store", data=data.aged_series),
+                    dcc.Store(id="aged_detail"),
+                    dcc.Graph(id="aged_graph", style={"height": 500,}),
+                ],
+                className="time_series",
+                style={"padding": "3%"},
             ),
-        html.Div(
-            [
-                html.H3("年齢別感染者数（時系列）"),
-                dcc.Dropdown(
-                    id="age_dropdown",
-                    options=[
-                        {"value": age, "label": age} for age in aged_df["age"].unique()
+            *[
+                html.Div(
+                    [
+                        html.H3(title),
+                        dcc.Store(
+                            id=f"{name}_graph_src", data=figure_path(name, region)
+                        ),
+                        dcc.Graph(id=f"{name}_graph"),
                     ],
-                    multi=True,
-                    value=["10代未満", "10代"],
-                ),
-                dcc.Graph(id="aged_graph", style={"height": 500,}),
+                    className="time_series",
+                    style={"padding": "3%"},
+                )
+                for name, title in ANALYTICS_GRAPHS
             ],
-            className="time_series",
-            style={"padding": "3%"},
-        ),
-        # html.Div(
-        #     [
-        #         html.Div(
-        #             [
-        #                 html.H2(
-        #                     "ワクチン接種状況と見通し",
-        #                     style={"paddingTop": "3%"},
-        #                     className="text-white bg-primary",
-        #                 ),
-        #             ],
-        #             style={"width": "70%", "margin": "auto"},
-        #         ),
-
-        #             dcc.Dropdown(
-        #                     id="num_select",
-        #                     options=[
-        #                         {"value": s, "label": s} for s in ["1回目接種率", "2回目接種率"]
-        #                     ],
-        #                     value="2回目接種率",
-        #                     style={"width": "80%", "margin": "auto"},
-        #                 ),
-        #         html.Div(
-        #             [
+            # html.Div(
+            #     [
+            #         html.Div(
+            #             [
+            #                 html.H2(
+            #                     "ワクチン接種状況と見通し",
+            #                     style={"paddingTop": "3%"},
+            #                     className="text-white bg-primary",
+            #                 ),
+            #             ],
+            #             style={"width": "70%", "margin": "auto"},
+            #         ),
+
+            #             dcc.Dropdown(
+            #                     id="num_select",
+            #                     options=[
+            #                         {"value": s, "label": s} for s in ["1回目接種率", "2回目接種率"]
+            #                     ],
+            #                     value="2回目接種率",
+            #                     style={"width": "80%", "margin": "auto"},
+            #                 ),
+            #         html.Div(
+            #             [
                         
-        #                 dcc.Graph(id="seshu_graph"),
+            #                 dcc.Graph(id="seshu_graph"),
                         
-        #             ],
-        #             className="pcr_data",
-        #         ),
-        #         dcc.Graph(id='seshu_line', className='pcr_data'),
-        #     ],
-        #     className="first-parent",
-        # ),
-        # html.Div([
-        #     html.Div([dcc.Graph(figure=deliv_graph)], className="pcr_data"),
-        # ], className='first-parent')
-    ]
-)
+            #             ],
+            #             className="pcr_data",
+            #         ),
+            #         dcc.Graph(id='seshu_line', className='pcr_data'),
+            #     ],
+            #     className="first-parent",
+            # ),
+            # html.Div([
+            #     html.Div([dcc.Graph(figure=deliv_graph)], className="pcr_data"),
+            # ], className='first-parent')
+        ]
+    )
 
-app.layout = html.Div(
-    [
-        html.Div(
-            [html.H1("京都府コロナウィルス感染者数"), html.H2("年代別割合")],
-            className="container pt-3 my-3 bg-primary text-white",
-            style={"textAlign": "center"},
-        ),
-        html.Div(
-            [
-                dcc.Markdown(
-                    """
+
+def loading_layout() -> html.Div:
+    """
+    データの読み込み中に返すレイアウト。読み込みが終わるとページを読み直す
+    """
+    return html.Div(
+        [
+            html.Div(
+                [
+                    html.H1(f"{region_label()}コロナウィルス感染者数"),
+                    html.H2("データを読み込んでいます"),
+                ],
+                className="container pt-3 my-3 bg-primary text-white",
+                style={"textAlign": "center"},
+            ),
+            dcc.Store(id="ready_src", data=app.get_relative_path("/_ready")),
+            dcc.Interval(id="ready_interval", interval=1000),
+        ],
+        className="total_style",
+    )
+
+
+def serve_layout() -> html.Div:
+    """
+    アクセスごとに最新のデータでレイアウトを作る
+    """
+    ## /_ready と同じく、感染者とワクチンの両方のデータが揃うまでは読み込み中の画面を返す
+    data = store.current
+    if data is None or not vaccine_store.ready:
+        return loading_layout()
+    return html.Div(
+        [
+            html.Div(
+                [
+                    dcc.Markdown(
+                        """
             
             
-            """
-                ),
-            ],
-            style={"textAlign": "center", "backgroundColor": "white"},
-        ),
-        html.Div(children=contents),
-        html.Div(
-            [
-                dcc.Markdown(
-                    """
-                    感染者数のデータは[京都府の府内の新型コロナウィルス感染症対策サイト](https://kyoto.stopcovid19.jp/)のものを利用しています。   
-                    ワクチンのデータは[京都市情報館](https://www.city.kyoto.lg.jp/hokenfukushi/page/0000280084.html#a1)のものを利用しています。   
-                    このアプリケーションは[合同会社 長目](https://chomoku.com/)が作成しています。    
+                """
+                    ),
+                ],
+                style={"textAlign": "center", "backgroundColor": "white"},
+            ),
+            dcc.Dropdown(
+                id="region",
+                options=[
+                    {"value": region.name, "label": region.label}
+                    for region in REGIONS.values()
+                ],
+                value=DEFAULT_REGION,
+                clearable=False,
+                style={"width": "50%", "margin": "auto"}
+                if len(REGIONS) > 1
+                else {"display": "none"},
+            ),
+            dcc.Interval(id="region_interval", interval=1000, disabled=True),
+            html.Div(id="region_contents", children=make_contents(data)),
+            html.Div(
+                [
+                    dcc.Markdown(
+                        """
+                        感染者数のデータは[京都府の府内の新型コロナウィルス感染症対策サイト](https://kyoto.stopcovid19.jp/)のものを利用しています。   
+                        ワクチンのデータは[京都市情報館](https://www.city.kyoto.lg.jp/hokenfukushi/page/0000280084.html#a1)のものを利用しています。   
+                        このアプリケーションは[合同会社 長目](https://chomoku.com/)が作成しています。    
             
-            """
-                ),
-            ],
-            style={"textAlign": "center", "backgroundColor": "white"},
-        ),
-    ],
-    className="total_style",
+                """
+                    ),
+                ],
+                style={"textAlign": "center", "backgroundColor": "white"},
+            ),
+        ],
+        className="total_style",
+    )
+
+
+app.layout = serve_layout
+
+app.clientside_callback(
+    ClientsideFunction(namespace="regions", function_name="set_title"),
+    Input("page_title", "data"),
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace="loading", function_name="reload_when_ready"),
+    Output("ready_interval", "disabled"),
+    Input("ready_interval", "n_intervals"),
+    State("ready_src", "data"),
 )
 
 
-@app.callback(Output("second_graph", "figure"), Input("datepicker", "date"))
-def update_circle(selected_date):
-    selected_datetime = datetime(
-        int(selected_date.split("-")[0]),
-        int(selected_date.split("-")[1]),
-        int(selected_date.split("-")[2]),
+@app.callback(
+    Output("region_contents", "children"),
+    Output("region_interval", "disabled"),
+    Input("region", "value"),
+    Input("region_interval", "n_intervals"),
+    prevent_initial_call=True,
+)
+@metrics.timed("update_region")
+def update_region(region, _):
+    """
+    選択された地域の内容に切り替える。読み込み中なら終わるまで確認を続ける
+    """
+    data_store = region_store(region)
+    if data_store is None:
+        raise dash.exceptions.PreventUpdate
+    data = data_store.current
+    if data is not None:
+        return make_contents(data, region), True
+    if dash.callback_context.triggered_id == "region_interval":
+        return dash.no_update, False
+    loading = html.Div(
+        html.H3("データを読み込んでいます"), style={"textAlign": "center", "padding": "5%"}
     )
-    selected_df, sel_total = cal_counts(df, selected_datetime)
-    fig = draw_circle(selected_df, sel_total, selected_datetime)
-    return fig
+    return loading, False
 
 
-@app.callback(Output("aged_graph", "figure"), Input("age_dropdown", "value"))
-def update_line(selected_ages):
-    if selected_ages is None:
+@app.callback(
+    Output("second_graph", "figure"),
+    Input("datepicker", "start_date"),
+    Input("datepicker", "end_date"),
+    State("region", "value"),
+)
+@metrics.timed("update_circle")
+def update_circle(start_date, end_date=None, region=None):
+    if not start_date:
         raise dash.exceptions.PreventUpdate
-    sel_df = aged_df[aged_df["age"].isin(selected_ages)]
-    sel_df = sel_df.sort_values("date")
-    return draw_line(sel_df)
+    start = parse_date(start_date)
+    end = parse_date(end_date) if end_date else start
 
+    data = current_data(region)
+    version = f"{CODE_VERSION}:{data.version}"
+    figure_cache.set_version(version, scope=region)
 
-@app.callback(Output("seshu_graph", "figure"), Output('seshu_line', 'figure'), Input("num_select", "value"))
-def update_seshu_graph(selected_value):
-    fig = recent_pcr_graph(
-        seshu_data,
-        x_axis_name="年代",
-        y_axis_name=selected_value,
-        title=f"年代別接種率({selected_value}: {latest_seshu_date}時点)",
+    def build():
+        with metrics.timer("update_circle.filter"):
+            selected_df, sel_total = cal_range_counts(data.cube, data.stats, start, end)
+        with metrics.timer("update_circle.figure"):
+            return draw_circle(selected_df, sel_total, start, end)
+
+    return figure_cache.get_or_build(
+        (version, region, "circle", start, end), build, phase="update_circle"
     )
-    fig2 = recent_pcr_graph(
-        seshu_data,
-        x_axis_name='date',
-        y_axis_name=selected_value,
-        title=f"年代別接種率({selected_value}: 時系列)",
-        selector='line'
+
+
+## 変わらないグラフはレイアウトに含めず、ブラウザが ETag 付きで取得する
+app.clientside_callback(
+    ClientsideFunction(namespace="figures", function_name="load"),
+    Output("total_graph", "figure"),
+    Input("total_graph_src", "data"),
+)
+
+@app.callback(
+    Output("total_graph", "figure", allow_duplicate=True),
+    Input("total_graph", "relayoutData"),
+    State("region", "value"),
+    prevent_initial_call=True,
+)
+@metrics.timed("update_total_detail")
+def update_total_detail(relayout, region=None):
+    """
+    拡大された範囲だけを細かくした合計感染者数のグラフ
+    """
+    data = current_data(region)
+    window = relayout_window(relayout, data.cube.start)
+    version = f"{CODE_VERSION}:{data.version}"
+    figure_cache.set_version(version, scope=region)
+
+    def build():
+        with metrics.timer("update_total_detail.filter"):
+            df = lod_frame(data.total_lod, data.cube.start, 0, window)
+        with metrics.timer("update_total_detail.figure"):
+            fig = draw_line(df, graph_type="line", color=None)
+            fig.update_layout(uirevision="total")
+        return fig
+
+    return figure_cache.get_or_build(
+        (version, region, "total", window), build, phase="update_total_detail"
+    )
+
+
+for name, _ in ANALYTICS_GRAPHS:
+    app.clientside_callback(
+        ClientsideFunction(namespace="figures", function_name="load"),
+        Output(f"{name}_graph", "figure"),
+        Input(f"{name}_graph_src", "data"),
     )
+
+## 年代の選択はブラウザ側で処理する（assets/clientside.js）
+app.clientside_callback(
+    ClientsideFunction(namespace="aged", function_name="update_line"),
+    Output("aged_graph", "figure"),
+    Input("age_dropdown", "value"),
+    Input("aged_store", "data"),
+    Input("aged_detail", "data"),
+)
+
+
+@app.callback(
+    Output("aged_detail", "data"),
+    Input("aged_graph", "relayoutData"),
+    Input("age_dropdown", "value"),
+    State("region", "value"),
+    prevent_initial_call=True,
+)
+@metrics.timed("update_aged_detail")
+def update_aged_detail(relayout, selected_ages, region=None):
+    """
+    年代別のグラフで拡大された範囲の、選択中の年代の細かい系列
+    拡大した後に年代を追加した場合も、その年代の細かい系列を作り直す
+    """
+    data = current_data(region)
+    window = relayout_window(relayout, data.cube.start)
+    if window is None or not selected_ages:
+        return None
+    ages = [str(age) for age in data.cube.ages]
+    names, x, counts = list(), list(), list()
+    for age in selected_ages:
+        if age not in ages:
+            continue
+        idx, values = data.aged_lod.window(ages.index(age), *window)
+        names.append(age)
+        x.append(idx.tolist())
+        counts.append(values.tolist())
+    return {"window": list(window), "names": names, "x": x, "counts": counts}
+
+
+@app.callback(Output("seshu_graph", "figure"), Output('seshu_line', 'figure'), Input("num_select", "value"))
+@metrics.timed("update_seshu_graph")
+def update_seshu_graph(selected_value):
+    vaccine = vaccine_store.current
+    if vaccine is None:
+        raise dash.exceptions.PreventUpdate
+    with metrics.timer("update_seshu_graph.figure"):
+        fig = recent_pcr_graph(
+            vaccine.seshu_data,
+            x_axis_name="年代",
+            y_axis_name=selected_value,
+            title=f"年代別接種率({selected_value}: {vaccine.latest_seshu_date}時点)",
+            latest=vaccine.seshu_latest,
+        )
+        fig2 = recent_pcr_graph(
+            vaccine.seshu_data,
+            x_axis_name='date',
+            y_axis_name=selected_value,
+            title=f"年代別接種率({selected_value}: 時系列)",
+            selector='line'
+        )
     return fig, fig2
 
 
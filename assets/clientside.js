@@ -0,0 +1,121 @@
+// ブラウザ側で処理するコールバック
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    loading: {
+        // データの読み込みが終わったらページを読み直す
+        reload_when_ready: function (n, url) {
+            if (!url) {
+                return window.dash_clientside.no_update;
+            }
+            return fetch(url)
+                .then((response) => response.json())
+                .then(function (status) {
+                    if (status.ready) {
+                        window.location.reload();
+                        return true;
+                    }
+                    return false;
+                });
+        },
+    },
+    regions: {
+        // 選択された地域に合わせてページのタイトルを書き換える
+        set_title: function (title) {
+            if (title) {
+                document.title = title;
+            }
+        },
+    },
+    figures: {
+        // サーバーで圧縮済みのグラフを取得する（ETag で再検証される）
+        // 読み込み中（503）などで取得できなければ、Retry-After（なければ1秒）待って取得し直す
+        load: function (url) {
+            if (!url) {
+                return window.dash_clientside.no_update;
+            }
+            const attempt = function (n) {
+                return fetch(url)
+                    .then(function (response) {
+                        if (response.ok) {
+                            return response.json();
+                        }
+                        throw response;
+                    })
+                    .catch(function (error) {
+                        if (n >= 30) {
+                            return window.dash_clientside.no_update;
+                        }
+                        const header = error && error.headers ? error.headers.get("Retry-After") : null;
+                        const wait = (parseFloat(header) || 1) * 1000;
+                        return new Promise((resolve) => setTimeout(resolve, wait)).then(() =>
+                            attempt(n + 1)
+                        );
+                    });
+            };
+            return attempt(0);
+        },
+    },
+    aged: {
+        // 年代別感染者数（時系列）のグラフを、dcc.Store の年代ごとの感染者数から作る
+        // store は全期間を間引いたもの、detail は拡大された範囲の細かいもの
+        update_line: function (selectedAges, store, detail) {
+            if (!selectedAges || !store) {
+                return window.dash_clientside.no_update;
+            }
+            const start = Date.parse(store.start);
+            const toDate = (i) => new Date(start + i * 86400000).toISOString().slice(0, 10);
+            const series = function (age) {
+                const j = store.names.indexOf(age);
+                let x = store.x[j];
+                let y = store.counts[j];
+                const k = detail ? detail.names.indexOf(age) : -1;
+                if (k >= 0) {
+                    const lo = detail.window[0];
+                    const hi = detail.window[1];
+                    const before = x.findIndex((i) => i >= lo);
+                    const after = x.findIndex((i) => i > hi);
+                    const head = before < 0 ? x.length : before;
+                    const tail = after < 0 ? x.length : after;
+                    x = x.slice(0, head).concat(detail.x[k], x.slice(tail));
+                    y = y.slice(0, head).concat(detail.counts[k], y.slice(tail));
+                }
+                return { x: x.map(toDate), y: y };
+            };
+            const data = selectedAges
+                .filter((age) => store.names.indexOf(age) >= 0)
+                .map(function (age) {
+                    const s = series(age);
+                    return {
+                        type: "scatter",
+                        mode: "lines",
+                        name: age,
+                        x: s.x,
+                        y: s.y,
+                        hovertemplate:
+                            "age=" + age + "<br>date=%{x}<br>counts=%{y}<extra></extra>",
+                    };
+                });
+            return {
+                data: data,
+                layout: {
+                    xaxis: {
+                        title: { text: "date" },
+                        rangeselector: {
+                            buttons: [
+                                { count: 1, label: "1m", step: "month", stepmode: "backward" },
+                                { count: 3, label: "3m", step: "month", stepmode: "backward" },
+                                { count: 6, label: "6m", step: "month", stepmode: "backward" },
+                                { count: 1, label: "1y", step: "year", stepmode: "backward" },
+                                { step: "all" },
+                            ],
+                        },
+                        rangeslider: { visible: true },
+                        type: "date",
+                    },
+                    yaxis: { title: { text: "counts" } },
+                    showlegend: false,
+                    uirevision: "aged",
+                },
+            };
+        },
+    },
+});
@@ -0,0 +1,108 @@
+import json
+import os
+import shutil
+import time
+from typing import Dict, Optional
+
+"""
+    取り込んだデータをまとめたバンドル
+    data/bundles/<バージョン>/ に一式を置き、data/bundles/CURRENT に現在のバージョン名を書く
+    バンドルは作成後に変更しない。CURRENT の差し替えは os.replace で行うので、
+    読み込む側が作成途中のバンドルを見ることはない
+"""
+
+CURRENT = "CURRENT"
+MANIFEST = "manifest.json"
+
+
+def current_version(root: str) -> Optional[str]:
+    try:
+        with open(os.path.join(root, CURRENT)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def current_dir(root: str) -> Optional[str]:
+    version = current_version(root)
+    return None if version is None else os.path.join(root, version)
+
+
+def resolve(path: str, name: str) -> str:
+    """
+    path が CURRENT を指していれば、現在のバンドルの name のパスを返す
+    そうでなければ path をそのまま返す
+    """
+    if os.path.basename(path) != CURRENT:
+        return path
+    root = os.path.dirname(path)
+    return os.path.join(current_dir(root) or root, name)
+
+
+def load_manifest(bundle_dir: Optional[str]) -> Dict:
+    if bundle_dir is None:
+        return {}
+    try:
+        with open(os.path.join(bundle_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def new_bundle(root: str) -> str:
+    """
+    作成途中のバンドルのディレクトリを作る（publish するまで CURRENT からは見えない）
+    """
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, f".tmp-{os.getpid()}-{time.time_ns():x}")
+    os.makedirs(path)
+    return path
+
+
+def publish(root: str, tmp_dir: str, manifest: Dict, keep: int = 3) -> str:
+    """
+    作成したバンドルにバージョンを付けて公開し、CURRENT を差し替える
+    Params:
+        root: バンドルを置くディレクトリ
+        tmp_dir: new_bundle で作ったディレクトリ
+        manifest: manifest.json に書く内容
+        keep: 残しておく古いバンドルの数（CURRENT を含む）
+    Returns:
+        version: 公開したバージョン
+    """
+    version = time.strftime("%Y%m%d-%H%M%S") + f"-{time.time_ns() % 1000000:06d}"
+    with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+        json.dump(
+            {**manifest, "version": version}, f, ensure_ascii=False, indent=1, sort_keys=True
+        )
+    os.rename(tmp_dir, os.path.join(root, version))
+
+    pointer = os.path.join(root, f"{CURRENT}.tmp-{os.getpid()}")
+    with open(pointer, "w") as f:
+        f.write(version)
+    os.replace(pointer, os.path.join(root, CURRENT))
+
+    old = sorted(
+        name for name in os.listdir(root) if not name.startswith((".", CURRENT))
+    )
+    for name in old[:-keep]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    return version
+
+
+def link_file(src_dir: str, dst_dir: str, name: str) -> None:
+    """
+    前のバンドルの変わっていないファイルを新しいバンドルに入れる（ハードリンク、できなければコピー）
+    """
+    src, dst = os.path.join(src_dir, name), os.path.join(dst_dir, name)
+    if os.path.isdir(src):
+        shutil.copytree(src, dst, copy_function=_link_or_copy)
+    else:
+        _link_or_copy(src, dst)
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
@@ -0,0 +1,186 @@
+import re
+from functools import lru_cache
+from io import BytesIO
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from lxml import etree
+
+"""
+    京都府の感染者のページから、必要なテーブルと見出し（h3）だけを取り出す
+    pd.read_html はページ全体の DOM を作り全てのテーブルを読み込むが、
+    ここでは iterparse でページを先頭から読み、必要なテーブルを読み終えたところで止める
+    読み終えた要素はすぐに捨て、行は列ごとのリストに入れてから型の付いた配列にする
+"""
+
+_WHITESPACE = re.compile(r"[\r\n]+|\s{2,}")
+_INTEGER = re.compile(r"^[+-]?\d+$")
+
+
+class CasePage(NamedTuple):
+    """
+    ページから取り出したもの
+    heading: 最初の h3 の文字列（なければ None）
+    tables: テーブルの番号（ページの先頭から0始まり）ごとのデータフレーム
+    """
+
+    heading: Optional[str]
+    tables: Dict[int, pd.DataFrame]
+
+
+def _cell_text(cell: etree._Element) -> str:
+    """
+    セルの文字列（pd.read_html と同じく改行と連続した空白を1つの空白にする）
+    """
+    return _WHITESPACE.sub(" ", "".join(cell.itertext()).strip())
+
+
+def _typed(values: List[str]) -> np.ndarray:
+    """
+    列の値を配列にする。空でない値が全て整数なら int64（空があれば float64）、それ以外は object
+    空の値は欠損にする
+    """
+    present = [v for v in values if v != ""]
+    if present and all(_INTEGER.match(v) for v in present):
+        if len(present) == len(values):
+            return np.array(values, dtype=np.int64)
+        return np.array([float(v) if v != "" else np.nan for v in values])
+    column = np.empty(len(values), dtype=object)
+    column[:] = [v if v != "" else np.nan for v in values]
+    return column
+
+
+def _span(cell: etree._Element, name: str) -> int:
+    try:
+        return max(int(cell.get(name) or 1), 1)
+    except ValueError:
+        return 1
+
+
+def _expand_spans(table: etree._Element) -> List[Tuple[bool, List[str]]]:
+    """
+    テーブルの行ごとのセルの文字列。pd.read_html と同じく、
+    colspan のセルは右の列に、rowspan のセルは下の行の同じ位置に同じ文字列を入れる
+    Returns:
+        rows: (th だけの行か, セルの文字列) のリスト
+    """
+    rows = list()
+    # 上の行から続く rowspan のセル: (列の位置, 文字列, 残りの行数)
+    remainder: List[Tuple[int, str, int]] = list()
+    for tr in table.iter("tr"):
+        cells = [c for c in tr if c.tag in ("th", "td")]
+        if not cells and not remainder:
+            continue
+        texts: List[str] = list()
+        next_remainder = list()
+        for cell in cells:
+            while remainder and remainder[0][0] <= len(texts):
+                index, text, left = remainder.pop(0)
+                texts.append(text)
+                if left > 1:
+                    next_remainder.append((index, text, left - 1))
+            text = _cell_text(cell)
+            rowspan = _span(cell, "rowspan")
+            for _ in range(_span(cell, "colspan")):
+                if rowspan > 1:
+                    next_remainder.append((len(texts), text, rowspan - 1))
+                texts.append(text)
+        for index, text, left in remainder:
+            texts.append(text)
+            if left > 1:
+                next_remainder.append((index, text, left - 1))
+        rows.append((bool(cells) and all(c.tag == "th" for c in cells), texts))
+        remainder = next_remainder
+    # テーブルの最後の行より下まで続く rowspan
+    while remainder:
+        texts = list()
+        next_remainder = list()
+        for index, text, left in remainder:
+            texts.append(text)
+            if left > 1:
+                next_remainder.append((index, text, left - 1))
+        rows.append((False, texts))
+        remainder = next_remainder
+    return rows
+
+
+def _read_rows(table: etree._Element) -> pd.DataFrame:
+    """
+    テーブルの行を列ごとに読み込む。最初の行が th だけなら見出しとして使う
+    """
+    header = None
+    columns: List[List[str]] = list()
+    for all_th, texts in _expand_spans(table):
+        if header is None and not columns and all_th:
+            header = texts
+            continue
+        while len(columns) < len(texts):
+            columns.append([""] * (len(columns[0]) if columns else 0))
+        for i, column in enumerate(columns):
+            column.append(texts[i] if i < len(texts) else "")
+
+    if header is None:
+        names = list(range(len(columns)))
+    else:
+        names = [h if h else f"Unnamed: {i}" for i, h in enumerate(header)]
+        names += list(range(len(names), len(columns)))
+        n_rows = len(columns[0]) if columns else 0
+        columns += [[""] * n_rows for _ in range(len(names) - len(columns))]
+    return pd.DataFrame({name: _typed(column) for name, column in zip(names, columns)})
+
+
+def parse_case_page(
+    text: str, tables: Sequence[int] = (0,), need_heading: bool = False
+) -> CasePage:
+    """
+    ページから最初の h3 と、tables で指定した番号のテーブルを取り出す
+    指定したテーブルを全て読み終えたら（need_heading なら h3 も見つけたら）、それ以降は読まない
+    Params:
+        text: ページのHTML
+        tables: 取り出すテーブルの番号
+        need_heading: h3 が必要か
+    Returns:
+        page: 見出しとテーブル
+    """
+    wanted = set(tables)
+    last = max(wanted) if wanted else -1
+    heading = None
+    found = dict()
+    table_num = 0
+    events = etree.iterparse(
+        BytesIO(text.encode("utf-8")),
+        events=("end",),
+        tag=("h3", "table"),
+        html=True,
+        encoding="utf-8",
+    )
+    for _, elem in events:
+        if elem.tag == "h3":
+            if heading is None:
+                heading = _cell_text(elem)
+        else:
+            # 入れ子のテーブルは外側のテーブルの一部として読む
+            if any(parent.tag == "table" for parent in elem.iterancestors()):
+                continue
+            if table_num in wanted:
+                found[table_num] = _read_rows(elem)
+            table_num += 1
+        # 読み終えた要素と、それより前の兄弟要素は捨てる
+        if elem.getparent() is not None and elem.tag == "table":
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        if table_num > last and (heading is not None or not need_heading):
+            break
+    return CasePage(heading, found)
+
+
+@lru_cache(maxsize=8)
+def cached_case_page(
+    text: str, tables: Tuple[int, ...] = (0,), need_heading: bool = False
+) -> CasePage:
+    """
+    同じページを何度も解析しないように、直近のものを覚えておく（1-50のページは2回使う）
+    """
+    return parse_case_page(text, tables, need_heading)
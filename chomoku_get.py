@@ -1,11 +1,22 @@
 from os import replace
-from requests_html import HTMLSession
+import lxml.html
 import pandas as pd
 from typing import List, Tuple
 from datetime import datetime
 from datetime import timedelta
+import os
 import re
-import time
+
+from case_table import CasePage, cached_case_page
+from data_store import file_digest
+from fetcher import Fetcher
+from normalize import map_age, wareki_to_datetime
+from page_cache import Page, PageCache
+from patient_store import PatientStore
+from snapshot import append_snapshot
+
+# 京都府のページのURL。ローカルのサーバーで試す場合は環境変数で置き換える
+BASE_URL = os.environ.get("KYOTO_BASE_URL", "https://www.pref.kyoto.jp/kentai/corona/")
 
 # 年齢行の置き換えよう辞書
 replace_dict = {
@@ -35,51 +46,26 @@ replace_dict = {
 }
 
 
-def _wareki_to_datetime(date_str: str) -> datetime:
-    """
-    令和の和暦を西暦に変更し、datetime型で返す
-    Params:
-        date_str: 令和の日付（令和〇年〇月〇日）
-    Returns:
-        the_datetime: 西暦の日付
-    
-    """
-    if date_str[:2] == "令和":
-        dt_str = date_str[2:]
-        dt_str = dt_str.split("年")
-        dt_year = int(dt_str[0])
-        dt_year = 2018 + dt_year
-        dt_str = dt_str[1].split("月")
-        dt_month = int(dt_str[0])
-        dt_str = dt_str[1].split("日")
-        dt_day = int(dt_str[0])
-        the_datetime = datetime(dt_year, dt_month, dt_day)
-        return the_datetime
-    else:
-        pass
-
-
-def _latest_data_desc(page_url: str) -> Tuple[datetime, int]:
+def _latest_data_desc(page_url: str, fetcher: Fetcher) -> Tuple[datetime, int]:
     """
         京都府のサイトから最新データの日付、感染者数を取得する
         Params:
             page_url : サイトのURL
+            fetcher: ページの取得に使う Fetcher
         Returns:
             latest_date: datetime
     
     """
-    session = HTMLSession()
-    r = session.get(page_url)
-    top_content = r.html.find("h3")  # 日付の取得
-    date_cont = top_content[0].text.split("日")[0].split("月")
+    page = _latest_page(fetcher.get_page(page_url).text)
+    date_cont = page.heading.split("日")[0].split("月")  # 日付の取得
     data_day = int(date_cont[1])
     data_month = int(date_cont[0])
     date_year = (datetime.now() - timedelta(1)).year
     master_date = datetime(date_year, data_month, data_day)  # 資料の日付の取得完了
 
     # 感染者数のデータの取得
-    df = pd.read_html(page_url)[0]
-    master_count = int(df.iloc[0, 1].split("名")[0])
+    df = page.tables[0]
+    master_count = int(str(df.iloc[0, 1]).split("名")[0])
 
     return master_date, master_count
 
@@ -87,18 +73,20 @@ def _latest_data_desc(page_url: str) -> Tuple[datetime, int]:
 # リンクの数値を取得する関数
 
 
-def _get_hassei_url(select_num: int) -> List:
+def _get_hassei_url(select_num: int, fetcher: Fetcher) -> List:
     """
      京都の感染バックナンバーのURLを取得する
      Params:
         select_num: 取得するバックナンバーURLの数
+        fetcher: ページの取得に使う Fetcher
      Returns:
         link_list: select_numで指定された数のURLのリスト
     """
-    hassei_bn_url = "https://www.pref.kyoto.jp/kentai/corona/hassei-bn.html"
-    session = HTMLSession()
-    r = session.get(hassei_bn_url)
-    links = r.html.absolute_links
+    hassei_bn_url = f"{BASE_URL}hassei-bn.html"
+    page = fetcher.get_page(hassei_bn_url)
+    doc = lxml.html.fromstring(page.text, base_url=hassei_bn_url)
+    doc.make_links_absolute()
+    links = {link for _, _, link, _ in doc.iterlinks()}
     link_list = [link for link in links if re.search("hassei", link)]  # バックナンバーのURLを格納
     link_list = [
         link.split("hassei")[1].split(".")[0] for link in link_list
@@ -107,80 +95,147 @@ def _get_hassei_url(select_num: int) -> List:
     num_list = [int(num) for num in filter(r.match, link_list)]
     num_list = sorted(num_list)
     num_list = num_list[-select_num:]
-    link_list = [
-        f"https://www.pref.kyoto.jp/kentai/corona/hassei{i}.html" for i in num_list
-    ]
+    link_list = [f"{BASE_URL}hassei{i}.html" for i in num_list]
     return link_list
 
 
-def get_data(selected_num: int) -> pd.DataFrame:
+def get_data(selected_num: int, fetcher: Fetcher = None) -> pd.DataFrame:
     """
      バックナンバーをselected_numで指定した分と、1-50にあるデータを取得する
      関数。
      Params:
         selected_num: バックナンバーの数を指定する
+        fetcher: ページの取得に使う Fetcher（指定しなければ作成する）
      Returns:
         data: バックナンバー＋最新のデータを持つ
     """
-    link_list = _get_hassei_url(selected_num)
-    data = pd.DataFrame()
-    for link in link_list:
-        df = pd.read_html(link)[0]
-        df = df[df["発表日"] != "（欠番）"]
-        df = _rename_data(df)
-        data = pd.concat([data, df])
-        time.sleep(2)
-    df = pd.read_html("https://www.pref.kyoto.jp/kentai/corona/hassei1-50.html")[1]
-    df = _rename_data(df)
-    df = df[df["発表日"] != "（欠番）"]
-    data = pd.concat([data, df])
+    if fetcher is None:
+        fetcher = Fetcher()
+    return read_pages(fetch_pages(selected_num, fetcher), fetcher)
+
+
+def fetch_pages(selected_num: int, fetcher: Fetcher) -> List[Page]:
+    """
+    バックナンバーをselected_numで指定した分と、1-50のページを取得する
+    最後の要素が1-50のページ
+    """
+    link_list = _get_hassei_url(selected_num, fetcher)
+    # バックナンバーは公開後に変わらないので、キャッシュがあればリクエストしない
+    pages = fetcher.get_pages(link_list, immutable=True)
+    pages.append(fetcher.get_page(f"{BASE_URL}hassei1-50.html"))
+    return pages
+
+
+def read_pages(pages: List[Page], fetcher: Fetcher) -> pd.DataFrame:
+    """
+    fetch_pages で取得したページのテーブルを読み込み、1つのデータフレームにする
+    """
+    frames = [_read_table(page, 0, fetcher) for page in pages[:-1]]
+    frames.append(_read_table(pages[-1], 1, fetcher, latest=True))
+    data = pd.concat(frames)
     data = data.reset_index(drop=True)
     data = data.sort_values("date")
     return data
 
 
+def _latest_page(text: str) -> CasePage:
+    """
+    1-50のページは、上部の発表（h3 とテーブル0）と感染者のテーブル（テーブル1）を一度に読む
+    """
+    return cached_case_page(text, (0, 1), need_heading=True)
+
+
+def _read_table(
+    page: Page, table_num: int, fetcher: Fetcher, latest: bool = False
+) -> pd.DataFrame:
+    """
+    ページの感染者のテーブルを読み込む
+    前回と同じ内容のページであれば、保存してあるデータフレームを使う
+    latest は1-50のページの場合に指定する
+    """
+    if fetcher.cache is not None:
+        df = fetcher.cache.load_frame(page)
+        if df is not None:
+            return df
+    parsed = _latest_page(page.text) if latest else cached_case_page(page.text, (table_num,))
+    df = parsed.tables[table_num].copy()
+    df = df[df["発表日"] != "（欠番）"]
+    df = _rename_data(df)
+    if fetcher.cache is not None:
+        fetcher.cache.store_frame(page, df)
+    return df
+
+
 def _rename_data(df):
     df = df.rename({"Unnamed: 0": "事例"}, axis=1)
-    df["date"] = df["発表日"].map(_wareki_to_datetime)
-    df["age"] = df["年代"].map(replace_dict)
+    df["date"] = wareki_to_datetime(df["発表日"])
+    df["age"] = map_age(df["年代"], replace_dict)
     return df
 
 
-def update_data(data_path: str, page_url: str, selected_num: int) -> None:
+def is_complete(
+    page_df: pd.DataFrame, page_url: str, fetcher: Fetcher
+) -> Tuple[bool, datetime, int]:
+    """
+    テーブルの最新の日付と感染者数が、ページ上部の発表（日付、感染者数）と一致するか
+    一致しなければテーブルがまだ更新途中とみなす
+    Returns:
+        (一致するか, 発表の日付, 発表の感染者数)
+    """
+    page_latest_date = max(page_df["date"].dropna())
+    latest_data_num = len(page_df[page_df["date"] == page_latest_date])
+    master_date, master_count = _latest_data_desc(page_url, fetcher)
+    print(f"{master_date} / {master_count}/ {page_latest_date} / {latest_data_num}")
+    ok = master_date == page_latest_date and latest_data_num == master_count
+    return ok, master_date, master_count
+
+
+def update_data(
+    data_path: str, page_url: str, selected_num: int, fetcher: Fetcher = None
+) -> None:
     """
         京都府のコロナ感染者数のテーブルが最新のものに更新されるかチェックして、
-        最新であればCSVファイルを更新、保存する
+        最新であれば新しい事例だけを月ごとのCSVとkyoto_covid2.csvに追記する
 
         Params:
-            data_path: csvfileへのパス
+            data_path: 月ごとのCSVを置くディレクトリ
             page_url: 感染者数ページへのURL
             selected_num: バックナンバーの取得数
+            fetcher: ページの取得に使う Fetcher（指定しなければ作成する）
 
     """
-    page_df = get_data(selected_num)
-    page_latest_date = max(page_df["date"].dropna())
-    latest_data_num = len(page_df[page_df["date"] == page_latest_date])
-
-    base_data = pd.read_csv(data_path, index_col=0, parse_dates=["date"])  # 保有するデータ
-    base_data_latest_date = max(base_data["date"])
-    master_date, master_count = _latest_data_desc(page_url)
-    print(f"{master_date} / {master_count}/ {page_latest_date} / {latest_data_num}")
-    if (
-        master_date == page_latest_date
-        and latest_data_num == master_count
-        and master_date != base_data_latest_date
-    ):
-        new_data = page_df.merge(base_data, on=list(base_data.columns), how="outer")
-        new_data = new_data.sort_values("date")
-        new_data = new_data.reset_index(drop=True)
-        new_data.to_csv("./data/kyoto_covid_patient.csv", index=None)
-        new_data[["date", "age"]].to_csv("./data/kyoto_covid2.csv", index=None)
+    if fetcher is None:
+        fetcher = Fetcher()
+    page_df = get_data(selected_num, fetcher)
+
+    store = PatientStore(data_path)  # 保有するデータ（manifest のみ読み込む）
+    base_data_latest_date = store.latest_date
+    complete, master_date, _ = is_complete(page_df, page_url, fetcher)
+    if complete and master_date != base_data_latest_date:
+        new_data = store.upsert(page_df)
+        # スナップショットには追記した行だけを書き足す
+        digest = file_digest("./data/kyoto_covid2.csv")
+        new_data[["date", "age"]].to_csv(
+            "./data/kyoto_covid2.csv", mode="a", header=False, index=None
+        )
+        append_snapshot(new_data[["date", "age"]], "./data/kyoto_covid2.csv", digest)
+        print(f"{len(new_data)} rows added / {store.count(master_date)} on {master_date}")
         print("done!")
     else:
         print("Not Yet!")
 
 
 if __name__ == "__main__":
-    data_path = "./data/kyoto_covid_patient.csv"
-    page_url = "https://www.pref.kyoto.jp/kentai/corona/hassei1-50.html"
-    update_data(data_path, page_url, 5)
+    data_path = "./data/patients"
+    legacy_path = "./data/kyoto_covid_patient.csv"
+    store = PatientStore(data_path)
+    if store.latest_date is None and os.path.exists(legacy_path):
+        # 以前の1ファイルのデータを月ごとのファイルに移す
+        store.upsert(pd.read_csv(legacy_path, parse_dates=["date"]))
+    page_url = f"{BASE_URL}hassei1-50.html"
+    fetcher = Fetcher(
+        concurrency=int(os.environ.get("FETCH_CONCURRENCY", 2)),
+        rate=float(os.environ.get("FETCH_RATE", 0.5)),
+        cache=PageCache(os.environ.get("PAGE_CACHE_DIR", "./data/page_cache")),
+    )
+    update_data(data_path, page_url, 5, fetcher)
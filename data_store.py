@@ -0,0 +1,129 @@
+import hashlib
+import os
+import threading
+import time
+import traceback
+from typing import Any, Callable, Optional
+
+
+def data_version(path: str) -> str:
+    """
+    データファイルの更新時刻とサイズからデータのバージョン文字列を作る
+    Params:
+        path: データファイルへのパス
+    Returns:
+        version: ファイルが変わると変わる文字列
+    """
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def file_digest(path: str) -> str:
+    """
+    ファイルの内容のハッシュ（チェックアウトなどで更新時刻が変わっても同じになる）
+    """
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class DataStore:
+    """
+    データファイルから作った集計結果を保持し、ファイルが更新されたら作り直す
+    作り直しはバックグラウンドのスレッドで行い、完成したものに一度に差し替える
+    （作成中のリクエストには古いデータを返す）
+
+    Params:
+        path: 監視するデータファイルへのパス
+        build: (path, version, previous) を受け取り、version 属性を持つ集計結果を返す関数
+               previous は作り直す前の集計結果（最初は None）
+        interval: ファイルの更新を確認する間隔（秒）
+        lazy: True なら最初の集計もバックグラウンドで行い、完成するまで current は None
+        version_of: path を受け取りデータのバージョンを返す関数（path から複数のファイルを読む時に指定する）
+    """
+
+    def __init__(
+        self,
+        path: str,
+        build: Callable[[str, str, Any], Any],
+        interval: float = 60,
+        lazy: bool = False,
+        version_of: Callable[[str], str] = data_version,
+    ):
+        self.path = path
+        self.build = build
+        self.interval = interval
+        self.version_of = version_of
+        self._lock = threading.Lock()
+        self._loader = None
+        self._current = None
+        self.build_sec = None
+        if lazy:
+            self._checked = time.monotonic()
+            self._start_loader(self.version_of(path))
+        else:
+            self._load(self.version_of(path))
+            self._checked = time.monotonic()
+
+    @property
+    def current(self) -> Any:
+        """
+        最新の集計結果。必要であれば作り直しを開始する
+        """
+        self._maybe_reload()
+        return self._current
+
+    @property
+    def ready(self) -> bool:
+        return self._current is not None
+
+    @property
+    def version(self) -> Optional[str]:
+        return None if self._current is None else self._current.version
+
+    def _start_loader(self, version: str) -> None:
+        self._loader = threading.Thread(
+            target=self._reload, args=(version,), daemon=True
+        )
+        self._loader.start()
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked < self.interval:
+            return
+        with self._lock:
+            if now - self._checked < self.interval or self._loader is not None:
+                return
+            self._checked = now
+            try:
+                version = self.version_of(self.path)
+            except OSError:
+                return
+            if version == self.version:
+                return
+            self._start_loader(version)
+
+    def _load(self, version: str) -> None:
+        start = time.perf_counter()
+        data = self.build(self.path, version, self._current)
+        self.build_sec = time.perf_counter() - start
+        self._current = data
+        print(f"data loaded: {self.path} ({version}, {self.build_sec:.2f} sec)")
+
+    def _reload(self, version: str) -> None:
+        try:
+            self._load(version)
+        except Exception:
+            # 書き込み途中のファイルなどは次の確認で読み直す
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                self._loader = None
+
+    def reload(self) -> None:
+        """
+        ファイルの更新を待たずに、同期的に作り直す
+        """
+        self._reload(self.version_of(self.path))
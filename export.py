@@ -0,0 +1,104 @@
+from typing import Iterator, List
+
+import numpy as np
+import pandas as pd
+
+from aggregate import CountCube
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow がなければ CSV だけを返す
+    pa = pq = None
+
+"""
+    集計済みのデータを、少しずつ CSV（または Parquet）にして返すジェネレーター
+    全体を一度に文字列にしないので、ダウンロードの大きさによらずメモリの使用量は一定になる
+"""
+
+CHUNK_ROWS = 4096
+
+
+def parquet_available() -> bool:
+    return pq is not None
+
+
+def count_frames(cube: CountCube, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    日付×年代の感染者数を、date, total, 年代ごとの列を持つデータフレームとして chunk_rows 日ずつ返す
+    """
+    ages = [str(age) for age in cube.ages]
+    for lo in range(0, len(cube.counts), chunk_rows):
+        hi = min(lo + chunk_rows, len(cube.counts))
+        frame = pd.DataFrame(np.asarray(cube.counts[lo:hi]), columns=ages)
+        frame.insert(0, "total", np.asarray(cube.totals[lo:hi]))
+        frame.insert(
+            0, "date", pd.date_range(cube.start + pd.Timedelta(days=lo), periods=hi - lo)
+        )
+        yield frame
+
+
+def table_frames(df: pd.DataFrame, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    データフレームを chunk_rows 行ずつ返す
+    """
+    for lo in range(0, len(df), chunk_rows):
+        yield df.iloc[lo : lo + chunk_rows]
+
+
+def csv_chunks(frames: Iterator[pd.DataFrame]) -> Iterator[str]:
+    """
+    データフレームを順に CSV にする（見出しは最初の1回だけ）
+    """
+    header = True
+    for frame in frames:
+        yield frame.to_csv(index=False, header=header, date_format="%Y-%m-%d")
+        header = False
+
+
+class _Sink:
+    """
+    ParquetWriter が書き込んだバイト列を貯めておき、take で取り出す
+    """
+
+    def __init__(self):
+        self.chunks: List[bytes] = list()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def parquet_chunks(frames: Iterator[pd.DataFrame]) -> Iterator[bytes]:
+    """
+    データフレームを1つずつ Parquet の行グループにし、書き込めた分から返す
+    """
+    sink = _Sink()
+    writer = None
+    for frame in frames:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), table.schema)
+        writer.write_table(table)
+        yield sink.take()
+    if writer is not None:
+        writer.close()
+    yield sink.take()
@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from page_cache import Page, PageCache
+
+# リトライする HTTP ステータス
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    トークンバケットによるリクエスト間隔の制限
+    rate 回/秒 のペースでトークンが貯まり、最大 capacity 個まで連続で取得できる
+
+    Params:
+        rate: 1秒あたりに補充されるトークン数
+        capacity: 貯められるトークンの最大数
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        トークンを1つ取得する。なければ貯まるまで待つ
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Fetcher:
+    """
+    1つのセッション（コネクションプール）を使い回してページを取得する
+    同時接続数は concurrency、リクエストの間隔は TokenBucket で制限し、
+    失敗したリクエストは backoff * 2**n 秒待ってリトライする
+
+    Params:
+        concurrency: 同時に取得するページ数
+        rate: 1秒あたりのリクエスト数の上限
+        burst: 連続で送れるリクエスト数
+        retries: リトライの回数
+        backoff: リトライまでの待ち時間の基準（秒）
+        timeout: 1リクエストのタイムアウト（秒）
+        session: 使用するセッション（指定しなければ作成する）
+        cache: 指定すると get_page で条件付きリクエストを送り、内容を保存する
+        fixture_url: 指定すると元の URL の前に付け、記録を再生するサーバーから取得する（fixtures.py）。
+                     指定しなければ環境変数 FETCH_FIXTURE_URL を使う
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 4,
+        rate: float = 1.0,
+        burst: int = 1,
+        retries: int = 3,
+        backoff: float = 1.0,
+        timeout: float = 30,
+        session: requests.Session = None,
+        cache: PageCache = None,
+        fixture_url: str = None,
+    ):
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+        self.cache = cache
+        self.fixture_url = fixture_url or os.environ.get("FETCH_FIXTURE_URL", "")
+        # この Fetcher で一度取得したページは再度リクエストしない
+        self._pages = dict()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """
+        url を取得する。接続エラーやサーバーエラーの場合はリトライする
+        """
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                r = self.session.get(self.fixture_url + url, timeout=self.timeout, **kwargs)
+                if r.status_code not in RETRY_STATUS:
+                    r.raise_for_status()
+                    return r
+                error = requests.HTTPError(f"{r.status_code} for {url}", response=r)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        raise error
+
+    def get_text(self, url: str, **kwargs) -> str:
+        """
+        url のHTMLを文字列で返す
+        Content-Type に文字コードがなければ内容から推定する
+        """
+        return _decode(self.get(url, **kwargs))
+
+    def get_page(self, url: str, immutable: bool = False) -> Page:
+        """
+        url のページを返す。キャッシュがあれば条件付きリクエストを送り、
+        変わっていなければ（304）キャッシュの内容を返す
+        Params:
+            url: ページのURL
+            immutable: 公開後に変わらないページ（バックナンバー）か。
+                       True でキャッシュがあればリクエストを送らない
+        Returns:
+            page: 取得したページ
+        """
+        if url in self._pages:
+            return self._pages[url]
+        if self.cache is None:
+            text = self.get_text(url)
+            page = Page(url, text, None, True)
+        else:
+            page = self.cache.load(url)
+            if page is None or not immutable:
+                headers = self.cache.validators(url) if page else dict()
+                r = self.get(url, headers=headers)
+                if r.status_code != 304 or page is None:
+                    page = self.cache.store(
+                        url,
+                        _decode(r),
+                        r.headers.get("ETag"),
+                        r.headers.get("Last-Modified"),
+                    )
+        self._pages[url] = page
+        return page
+
+    def get_pages(self, urls: List[str], immutable: bool = False) -> List[Page]:
+        """
+        urls を並列に get_page で取得し、同じ順番で返す
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(lambda url: self.get_page(url, immutable), urls))
+
+
+def _decode(r: requests.Response) -> str:
+    """
+    Content-Type に文字コードがなければ内容から推定して文字列にする
+    """
+    if "charset" not in r.headers.get("Content-Type", ""):
+        r.encoding = r.apparent_encoding
+    return r.text
@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+import plotly.graph_objects as go
+
+
+class FigureCache:
+    """
+    シリアライズしたグラフ(JSON文字列)を保持するLRUキャッシュ
+    キーの先頭要素をデータのバージョンとし、バージョンが変わると古いものは破棄する
+    バージョンは scope（地域など）ごとに持つ
+
+    Params:
+        max_bytes: 保持するJSONの合計サイズの上限
+        observe: (処理名, 秒) を受け取り、JSONへの変換にかかった時間を記録する関数
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        observe: Optional[Callable[[str, float], None]] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.observe = observe
+        self.versions = dict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_version(self, version: str, scope: Hashable = None) -> None:
+        """
+        scope のデータのバージョンを設定する。変わっていれば前のバージョンのグラフを破棄する
+        """
+        with self._lock:
+            old = self.versions.get(scope)
+            if version == old:
+                return
+            self.versions[scope] = version
+            if old is None:
+                return
+            for key in [key for key in self._items if key[0] == old]:
+                self._size -= len(self._items.pop(key))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            payload = self._items.get(key)
+            if payload is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def put(self, key: Hashable, payload: str) -> None:
+        size = len(payload)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._size -= len(self._items.pop(key))
+            self._items[key] = payload
+            self._size += size
+            while self._size > self.max_bytes:
+                _, old = self._items.popitem(last=False)
+                self._size -= len(old)
+                self.evictions += 1
+
+    def get_or_build(
+        self, key: Hashable, build: Callable[[], go.Figure], phase: str = "figure"
+    ) -> Dict:
+        """
+        キャッシュにあればそれを、なければ build でグラフを作成して保存したものを返す
+        Params:
+            key: (データのバージョン, 入力値) のタプル
+            build: グラフを作成する関数
+            phase: 処理時間を記録する時の名前（"{phase}.serialize" として記録する）
+        Returns:
+            figure: dcc.Graph の figure にそのまま渡せる辞書
+        """
+        payload = self.get(key)
+        if payload is None:
+            fig = build()
+            start = time.perf_counter()
+            payload = fig.to_json()
+            if self.observe is not None:
+                self.observe(f"{phase}.serialize", time.perf_counter() - start)
+            self.put(key, payload)
+        return json.loads(payload)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "items": len(self._items),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,177 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple, Optional
+
+import requests
+
+"""
+    取得するページを記録して再生する、ローカルの HTTP サーバー
+    Fetcher は環境変数 FETCH_FIXTURE_URL（例: http://127.0.0.1:8765/）があると、
+    元の URL の前にそれを付けて（http://127.0.0.1:8765/https://www.pref.kyoto.jp/...）このサーバーから取得する
+
+    記録（--record）: 記録のない URL は元のサイトから取得し、ステータス、ヘッダー、本文を保存してから返す
+    再生: 記録した内容だけを返す（記録のない URL は 404）。ネットワークなしで取り込み全体を実行、計測できる
+    使い方: python fixtures.py [--record] [--dir data/fixtures] [--port 8765] [--delay-ms 0]
+"""
+
+## 記録して再生するレスポンスヘッダー（文字コードの推定と条件付きリクエストに使う）
+HEADERS = ["Content-Type", "ETag", "Last-Modified"]
+
+
+class Fixture(NamedTuple):
+    """
+    記録したレスポンス
+    """
+
+    url: str
+    status: int
+    headers: dict
+    body: bytes
+
+
+class FixtureStore:
+    """
+    URLごとに、レスポンスを <ハッシュ>.json（URL、ステータス、ヘッダー）と <ハッシュ>.body に保存する
+
+    Params:
+        fixture_dir: 保存するディレクトリ
+    """
+
+    def __init__(self, fixture_dir: str = "data/fixtures"):
+        self.fixture_dir = fixture_dir
+        os.makedirs(fixture_dir, exist_ok=True)
+
+    def _path(self, url: str, suffix: str) -> str:
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.fixture_dir, key + suffix)
+
+    def load(self, url: str) -> Optional[Fixture]:
+        try:
+            with open(self._path(url, ".json")) as f:
+                meta = json.load(f)
+            with open(self._path(url, ".body"), "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        return Fixture(url, meta["status"], meta["headers"], body)
+
+    def save(self, fixture: Fixture) -> None:
+        # 本文を先に書き、json があれば本文も揃っているようにする
+        for suffix, data in [
+            (".body", fixture.body),
+            (
+                ".json",
+                json.dumps(
+                    {"url": fixture.url, "status": fixture.status, "headers": fixture.headers},
+                    ensure_ascii=False,
+                ).encode("utf-8"),
+            ),
+        ]:
+            path = self._path(fixture.url, suffix)
+            tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+
+def _not_modified(fixture: Fixture, request_headers) -> bool:
+    """
+    条件付きリクエストの検証子が記録したものと同じか
+    """
+    etag = fixture.headers.get("ETag")
+    last_modified = fixture.headers.get("Last-Modified")
+    if etag and request_headers.get("If-None-Match") == etag:
+        return True
+    return bool(last_modified and request_headers.get("If-Modified-Since") == last_modified)
+
+
+def make_handler(
+    store: FixtureStore, record: bool = False, delay: float = 0, timeout: float = 30
+):
+    """
+    リクエストのパス（先頭の / を除いたもの）を元の URL として、記録した内容を返すハンドラー
+    Params:
+        store: 記録の保存先
+        record: 記録のない URL を元のサイトから取得して記録するか
+        delay: 返す前に待つ時間（秒。実際のサイトの遅さを再現する）
+        timeout: 元のサイトから取得する時のタイムアウト（秒）
+    """
+    # 記録の時は1つのセッションを使い回す（ハンドラーはスレッドごとに動くのでロックをかける）
+    session = requests.Session()
+    lock = threading.Lock()
+
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = self.path[1:]
+            fixture = store.load(url)
+            if fixture is None and record:
+                with lock:
+                    r = session.get(url, timeout=timeout)
+                fixture = Fixture(
+                    url,
+                    r.status_code,
+                    {k: r.headers[k] for k in HEADERS if k in r.headers},
+                    r.content,
+                )
+                if r.status_code < 500:
+                    store.save(fixture)
+            if delay:
+                time.sleep(delay)
+            if fixture is None:
+                self.send_error(404, f"no fixture for {url}")
+                return
+            if _not_modified(fixture, self.headers):
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(fixture.status)
+            for key, value in fixture.headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(fixture.body)))
+            self.end_headers()
+            self.wfile.write(fixture.body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FixtureHandler
+
+
+def serve(
+    fixture_dir: str = "data/fixtures",
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    record: bool = False,
+    delay: float = 0,
+) -> ThreadingHTTPServer:
+    """
+    サーバーを作る（serve_forever は呼び出し側で行う。port=0 なら空いているポートを使う）
+    """
+    handler = make_handler(FixtureStore(fixture_dir), record=record, delay=delay)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def fixture_url(server: ThreadingHTTPServer) -> str:
+    """
+    FETCH_FIXTURE_URL に指定する URL
+    """
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", action="store_true")
+    parser.add_argument("--dir", default="data/fixtures")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay-ms", type=float, default=0)
+    args = parser.parse_args()
+    server = serve(args.dir, args.host, args.port, args.record, args.delay_ms / 1000)
+    print(f"{'recording' if args.record else 'replaying'}: FETCH_FIXTURE_URL={fixture_url(server)}")
+    server.serve_forever()
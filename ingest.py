@@ -0,0 +1,310 @@
+import hashlib
+import os
+import shutil
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+import requests
+
+import bundle
+from chomoku_get import BASE_URL, fetch_pages, is_complete, read_pages
+from data_store import file_digest
+from fetcher import Fetcher
+from get_vaccine_data import DATA_URL, parse_page
+from page_cache import Page, PageCache
+from patient_store import PatientStore
+from prepro_data import PATIENTS_URL, REPLACE_DICT, _data_prepro, _parse_patients
+from snapshot import append_snapshot, snapshot_path, write_snapshot
+from vaccine_store import FORECAST_DTYPES, SESHU_DTYPES, VaccineTable
+
+"""
+    データの取り込みをまとめて行う
+    データ元（Source）ごとに fetch → parse → normalize → aggregate の順に処理し、
+    最後に全てのデータ元の結果を1つのバンドルとして公開する（bundle.py）
+
+    各段階の出力のハッシュを前回のバンドルの manifest.json と比べ、
+    変わっていなければ以降の段階は行わず、前回のバンドルのファイルをそのまま使う
+    データ元ごとの処理は並列に行う
+"""
+
+STAGES = ["fetch", "parse", "normalize"]
+
+## バンドルがまだない場合に、追記するデータの元にするディレクトリ
+SEED_DIR = "./data"
+
+
+def content_digest(value: Any) -> str:
+    """
+    段階の出力のハッシュ（ページは取得時のハッシュ、データフレームは値のハッシュを使う）
+    """
+    sha = hashlib.sha1()
+    _update_digest(sha, value)
+    return sha.hexdigest()
+
+
+def _update_digest(sha, value: Any) -> None:
+    if isinstance(value, Page):
+        sha.update(value.digest.encode("utf-8"))
+    elif isinstance(value, str):
+        sha.update(value.encode("utf-8"))
+    elif isinstance(value, pd.DataFrame):
+        sha.update(",".join(map(str, value.columns)).encode("utf-8"))
+        sha.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _update_digest(sha, item)
+    else:
+        sha.update(repr(value).encode("utf-8"))
+
+
+class Source:
+    """
+    データ元。段階ごとの処理を持つ
+
+    Attributes:
+        name: データ元の名前（manifest.json のキー）
+        files: バンドルに置くファイル（またはディレクトリ）の名前
+    """
+
+    name = ""
+    files: List[str] = []
+
+    def __init__(self, fetcher: Fetcher):
+        self.fetcher = fetcher
+
+    def fetch(self, _: None) -> Any:
+        raise NotImplementedError
+
+    def parse(self, raw: Any) -> Any:
+        return raw
+
+    def normalize(self, parsed: Any) -> Any:
+        """
+        None を返すと、データがまだ揃っていないとみなして前回のものを使う
+        """
+        return parsed
+
+    def aggregate(self, normalized: Any, out_dir: str, base_dir: str) -> None:
+        """
+        out_dir にファイルを書き出す。base_dir は前回のバンドル（なければ SEED_DIR）
+        """
+        raise NotImplementedError
+
+
+class PatientsSource(Source):
+    """
+    stop-covid19-kyoto の patients.json（アプリの感染者データ）
+    """
+
+    name = "patients"
+    files = ["kyoto_patients.csv", "kyoto_patients.snapshot"]
+
+    def fetch(self, _):
+        return self.fetcher.get_page(PATIENTS_URL)
+
+    def parse(self, page):
+        return _parse_patients(page.text)
+
+    def normalize(self, df):
+        return _data_prepro(df, REPLACE_DICT)
+
+    def aggregate(self, df, out_dir, base_dir):
+        path = os.path.join(out_dir, "kyoto_patients.csv")
+        df.to_csv(path, index=None)
+        write_snapshot(df, path)
+
+
+class VaccineSource(Source):
+    """
+    京都市のワクチン接種のページ（接種数と配送数）
+    """
+
+    name = "vaccine"
+    files = [
+        "vaccined_num.csv",
+        "vaccined_num.csv.index.json",
+        "vac_forecast.csv",
+        "vac_forecast.csv.index.json",
+    ]
+
+    def fetch(self, _):
+        return self.fetcher.get_page(DATA_URL)
+
+    def parse(self, page):
+        return parse_page(page.text)
+
+    def aggregate(self, frames, out_dir, base_dir):
+        seshu_df, forecast_df = frames
+        for name, dtypes, df in [
+            ("vaccined_num.csv", SESHU_DTYPES, seshu_df),
+            ("vac_forecast.csv", FORECAST_DTYPES, forecast_df),
+        ]:
+            # 追記するので、前のバンドルのファイルはリンクせずにコピーする
+            if os.path.exists(os.path.join(base_dir, name)):
+                shutil.copy2(os.path.join(base_dir, name), os.path.join(out_dir, name))
+            VaccineTable(os.path.join(out_dir, name), dtypes).append(df)
+
+
+class PrefSource(Source):
+    """
+    京都府の感染者のページ（月ごとのCSVと kyoto_covid2.csv）
+    月ごとのCSV（PatientStore）もバンドルの中に置くので、途中で失敗すれば追記した事例ごと捨てられ、
+    次の実行で前回のバンドルの事例と比べて追記し直される
+
+    Params:
+        selected_num: バックナンバーの取得数
+    """
+
+    name = "kyoto_pref"
+    files = ["kyoto_covid2.csv", "kyoto_covid2.snapshot", "patients"]
+
+    def __init__(self, fetcher: Fetcher, selected_num: int = 5):
+        super().__init__(fetcher)
+        self.selected_num = selected_num
+
+    def fetch(self, _):
+        return fetch_pages(self.selected_num, self.fetcher)
+
+    def parse(self, pages):
+        return read_pages(pages, self.fetcher)
+
+    def normalize(self, df):
+        complete, _, _ = is_complete(df, f"{BASE_URL}hassei1-50.html", self.fetcher)
+        if not complete:
+            return None
+        return df
+
+    def aggregate(self, df, out_dir, base_dir):
+        # 前のバンドルの月ごとのCSVはリンクし、追記する月のファイルだけ PatientStore がコピーする
+        if os.path.isdir(os.path.join(base_dir, "patients")):
+            bundle.link_file(base_dir, out_dir, "patients")
+        new_data = PatientStore(os.path.join(out_dir, "patients")).upsert(df)
+        path = os.path.join(out_dir, "kyoto_covid2.csv")
+        digest = None
+        if os.path.exists(os.path.join(base_dir, "kyoto_covid2.csv")):
+            shutil.copy2(os.path.join(base_dir, "kyoto_covid2.csv"), path)
+            digest = file_digest(path)
+        # スナップショットは追記した行だけを書き足すので、前のバンドルのものはリンクせずにコピーする
+        if os.path.isdir(os.path.join(base_dir, "kyoto_covid2.snapshot")):
+            shutil.copytree(
+                os.path.join(base_dir, "kyoto_covid2.snapshot"), snapshot_path(path)
+            )
+        new_data[["date", "age"]].to_csv(
+            path, mode="a", header=not os.path.exists(path), index=None
+        )
+        append_snapshot(new_data[["date", "age"]], path, digest)
+
+
+def _keep_previous(source: Source, out_dir: str, base_dir: str) -> None:
+    """
+    前回のバンドル（なければ SEED_DIR）のファイルを新しいバンドルに入れる
+    """
+    for name in source.files:
+        if os.path.exists(os.path.join(base_dir, name)):
+            bundle.link_file(base_dir, out_dir, name)
+
+
+def run_source(source: Source, out_dir: str, base_dir: str, previous: Dict) -> Dict:
+    """
+    データ元の各段階を行う
+    Params:
+        source: データ元
+        out_dir: 作成中のバンドル
+        base_dir: 前回のバンドル（なければ SEED_DIR）
+        previous: 前回の manifest.json のこのデータ元の部分
+    Returns:
+        result: status（updated, unchanged, incomplete, failed）、段階ごとのハッシュと処理時間
+    """
+    old_digests = previous.get("digests", {})
+    result = {"status": "updated", "digests": {}, "sec": {}}
+    value = None
+    try:
+        for stage in STAGES:
+            start = time.perf_counter()
+            value = getattr(source, stage)(value)
+            result["sec"][stage] = time.perf_counter() - start
+            if value is None:
+                result.update(status="incomplete", digests=old_digests)
+                break
+            result["digests"][stage] = content_digest(value)
+            if result["digests"][stage] == old_digests.get(stage):
+                result.update(status="unchanged", digests=old_digests)
+                break
+        if result["status"] == "updated":
+            start = time.perf_counter()
+            source.aggregate(value, out_dir, base_dir)
+            result["sec"]["aggregate"] = time.perf_counter() - start
+            return result
+    except Exception:
+        traceback.print_exc()
+        result.update(status="failed", digests=old_digests)
+        for name in source.files:  # 書きかけのファイルは捨てる
+            path = os.path.join(out_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+    _keep_previous(source, out_dir, base_dir)
+    return result
+
+
+def run(sources: List[Source], root: str) -> Optional[str]:
+    """
+    全てのデータ元を並列に処理し、1つでも更新されていれば新しいバンドルを公開する
+    Returns:
+        version: 公開したバージョン（何も更新されていなければ None）
+    """
+    previous_dir = bundle.current_dir(root)
+    previous = bundle.load_manifest(previous_dir).get("sources", {})
+    base_dir = previous_dir or SEED_DIR
+    tmp_dir = bundle.new_bundle(root)
+    try:
+        with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+            futures = {
+                source.name: pool.submit(
+                    run_source, source, tmp_dir, base_dir, previous.get(source.name, {})
+                )
+                for source in sources
+            }
+            results = {name: future.result() for name, future in futures.items()}
+        for name, result in results.items():
+            print(f"{name}: {result['status']} {result['sec']}")
+        if previous_dir is not None and all(
+            result["status"] != "updated" for result in results.values()
+        ):
+            shutil.rmtree(tmp_dir)
+            return None
+        return bundle.publish(root, tmp_dir, {"sources": results})
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def make_sources(session: requests.Session, cache: PageCache) -> List[Source]:
+    """
+    データ元を作る。Fetcher は一度取得したページを覚えているので実行ごとに作る
+    （データ元ごとにサイトが違うので、アクセスの間隔もデータ元ごとに守る）
+    """
+    rate = float(os.environ.get("FETCH_RATE", 0.5))
+    concurrency = int(os.environ.get("FETCH_CONCURRENCY", 2))
+
+    def fetcher():
+        return Fetcher(concurrency=concurrency, rate=rate, session=session, cache=cache)
+
+    return [PatientsSource(fetcher()), VaccineSource(fetcher()), PrefSource(fetcher())]
+
+
+if __name__ == "__main__":
+    root = os.environ.get("DATA_BUNDLE_DIR", "./data/bundles")
+    interval = float(os.environ.get("INGEST_INTERVAL_SEC", 0))
+    cache = PageCache(os.environ.get("PAGE_CACHE_DIR", "./data/page_cache"))
+    session = requests.Session()
+    while True:
+        version = run(make_sources(session, cache), root)
+        print(f"published: {version}" if version else "no changes")
+        if interval <= 0:
+            break
+        time.sleep(interval)
@@ -0,0 +1,189 @@
+import json
+import re
+from array import array
+from typing import Dict, Iterable, Iterator, List
+
+import numpy as np
+import pandas as pd
+
+"""
+    大きな JSON の配列を、全体をオブジェクトにせずに1件ずつ読む
+    文字列を少しずつ受け取り、配列の要素を1つ読み終えるごとに返す（ijson の items と同じ使い方）
+    読んだ値は列ごとに、ユニークな値の番号（コード）だけを配列に貯める
+"""
+
+## 一度に受け取る文字数
+CHUNK_CHARS = 1 << 16
+
+_WHITESPACE = re.compile(r"[\s,]*")
+_COLON = re.compile(r"[\s:]*")
+
+
+def text_chunks(text: str, size: int = CHUNK_CHARS) -> Iterator[str]:
+    """
+    読み込み済みの文字列を size 文字ずつに分ける
+    """
+    for start in range(0, len(text), size):
+        yield text[start : start + size]
+
+
+def iter_items(chunks: Iterable[str], key: str) -> Iterator[dict]:
+    """
+    {..., key: [{...}, {...}, ...]} の key の配列の要素を1つずつ返す
+    トップレベルのキーを1つずつ読み、他のキーの値は読み飛ばす（入れ子の同じ名前のキーや文字列の中は見ない）
+    Params:
+        chunks: JSON の文字列を分けたもの
+        key: 配列を持つトップレベルのキー
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = 0
+
+    def read_more() -> bool:
+        nonlocal buffer
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        buffer += chunk
+        return True
+
+    def skip(pattern: re.Pattern, pos: int) -> int:
+        # 区切りを読み飛ばし、次の値の先頭の位置を返す
+        while True:
+            pos = pattern.match(buffer, pos).end()
+            if pos < len(buffer):
+                return pos
+            if not read_more():
+                raise ValueError("unexpected end of data")
+
+    def decode(pos: int):
+        # 値が途中で切れている（数値は最後まで読めたか分からない）時は、続きを読んでからやり直す
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if not read_more():
+                    raise
+                continue
+            if end == len(buffer) and read_more():
+                continue
+            return value, end
+
+    # トップレベルのキーを順に読み、key の配列の始まりを探す
+    pos = skip(_WHITESPACE, pos)
+    if buffer[pos] != "{":
+        raise ValueError("top-level value is not an object")
+    pos += 1
+    while True:
+        pos = skip(_WHITESPACE, pos)
+        if buffer[pos] == "}":
+            raise ValueError(f"{key} not found")
+        name, pos = decode(pos)
+        if not isinstance(name, str):
+            raise ValueError("invalid object key")
+        pos = skip(_COLON, pos)
+        if name == key and buffer[pos] == "[":
+            pos += 1
+            break
+        _, pos = decode(pos)
+        if pos > CHUNK_CHARS:
+            buffer, pos = buffer[pos:], 0
+
+    while True:
+        pos = skip(_WHITESPACE, pos)
+        if buffer[pos] == "]":
+            return
+        item, pos = decode(pos)
+        yield item
+        # 読み終えた部分を捨てる
+        if pos > CHUNK_CHARS:
+            buffer, pos = buffer[pos:], 0
+
+
+class ColumnBuffer:
+    """
+    1つの列の値を貯める。整数だけの間は整数の配列に、
+    それ以外の値が来たらユニークな値のリストとその番号の配列にする
+    欠損（None）は番号 -1 にする。リストや辞書の値は比べずにそのまま貯める
+    """
+
+    def __init__(self, rows: int = 0):
+        self.ints = array("q") if rows == 0 else None
+        self.codes = None if rows == 0 else array("q", [-1] * rows)
+        self.uniques: List = list()
+        self._lookup: Dict = dict()
+
+    def __len__(self) -> int:
+        return len(self.ints) if self.codes is None else len(self.codes)
+
+    def append(self, value) -> None:
+        if self.codes is None:
+            if type(value) is int:
+                self.ints.append(value)
+                return
+            self._to_codes()
+        if value is None:
+            self.codes.append(-1)
+            return
+        # 1 と True、1 と 1.0 を別の値として扱う
+        key = value if type(value) is str else (type(value), value)
+        try:
+            code = self._lookup.get(key)
+            if code is None:
+                code = self._lookup[key] = len(self.uniques)
+                self.uniques.append(value)
+        except TypeError:
+            code = len(self.uniques)
+            self.uniques.append(value)
+        self.codes.append(code)
+
+    def _to_codes(self) -> None:
+        ints, self.ints, self.codes = self.ints, None, array("q")
+        for value in ints:
+            self.append(value)
+
+    def to_array(self):
+        """
+        値が全て整数なら int64、全て文字列ならカテゴリ型、それ以外は object の配列にする
+        """
+        if self.codes is None:
+            return np.frombuffer(self.ints, dtype=np.int64).copy()
+        codes = np.frombuffer(self.codes, dtype=np.int64)
+        if all(type(v) is str for v in self.uniques):
+            return pd.Categorical.from_codes(codes, categories=self.uniques)
+        values = np.empty(len(self.uniques) + 1, dtype=object)
+        values[:-1] = self.uniques
+        values[-1] = None
+        return values[codes]
+
+
+def read_columns(items: Iterable[dict]) -> pd.DataFrame:
+    """
+    辞書を1件ずつ列のバッファーに入れ、データフレームにする（列は最初に現れた順）
+    """
+    columns: Dict[str, ColumnBuffer] = dict()
+    rows = 0
+    for item in items:
+        for name, value in item.items():
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = ColumnBuffer(rows)
+            column.append(value)
+        rows += 1
+        # キーが足りない辞書の分は欠損にする
+        if len(item) != len(columns):
+            for column in columns.values():
+                if len(column) < rows:
+                    column.append(None)
+    return pd.DataFrame({name: column.to_array() for name, column in columns.items()})
+
+
+def iso_dates(values) -> pd.DatetimeIndex:
+    """
+    "2020-01-30T08:00:00.000Z" のような値の先頭10文字を日付にする
+    ユニークな値だけを固定幅（10文字）の配列にして切り出し、まとめて変換してから全ての行に戻す
+    """
+    values = pd.Categorical(values)
+    heads = pd.to_datetime(np.asarray(values.categories, dtype="U10"), format="%Y-%m-%d")
+    return heads.take(values.codes, allow_fill=True, fill_value=pd.NaT)
@@ -0,0 +1,190 @@
+import cProfile
+import functools
+import itertools
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+import numpy as np
+from flask import Flask, Response, g, request
+
+"""
+    処理時間の計測と /metrics（Prometheus のテキスト形式）での公開
+    処理（phase）ごとに、ヒストグラムと直近の処理時間の p50/p95/p99 を持つ
+"""
+
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+QUANTILES = [0.5, 0.95, 0.99]
+
+
+class Histogram:
+    """
+    1つの処理の処理時間。バケットごとの件数と、直近 window 件の処理時間を持つ
+    """
+
+    def __init__(self, window: int = 1024):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, sec: float) -> None:
+        i = 0
+        while i < len(BUCKETS) and sec > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += sec
+        self.count += 1
+        self.recent.append(sec)
+
+    def quantiles(self) -> List[float]:
+        if not self.recent:
+            return [float("nan")] * len(QUANTILES)
+        return list(np.quantile(np.fromiter(self.recent, float), QUANTILES))
+
+
+class Metrics:
+    """
+    処理ごとの処理時間と、その他の値（gauge）をまとめたもの
+    """
+
+    def __init__(self, prefix: str = "covid"):
+        self.prefix = prefix
+        self._histograms = dict()
+        self._gauges = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, phase: str, sec: float) -> None:
+        with self._lock:
+            if phase not in self._histograms:
+                self._histograms[phase] = Histogram()
+            self._histograms[phase].observe(sec)
+
+    @contextmanager
+    def timer(self, phase: str):
+        """
+        with の中の処理時間を phase として記録する
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start)
+
+    def timed(self, phase: str) -> Callable:
+        """
+        関数の処理時間を phase として記録するデコレーター
+        """
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(phase):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def gauge(self, name: str, help_text: str, func: Callable[[], Dict[str, float]]):
+        """
+        /metrics を返す時に func を呼んで値を出力する
+        func は {ラベルの値: 値} を返す（ラベル名は key）
+        """
+        self._gauges[name] = (help_text, func)
+
+    def render(self) -> str:
+        """
+        Prometheus のテキスト形式で出力する
+        """
+        name = f"{self.prefix}_phase_seconds"
+        lines = [
+            f"# HELP {name} Duration of callbacks and data loading phases.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            for phase, hist in histograms:
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ["+Inf"], hist.counts):
+                    cumulative += count
+                    lines.append(
+                        f'{name}_bucket{{phase="{phase}",le="{bound}"}} {cumulative}'
+                    )
+                lines.append(f'{name}_sum{{phase="{phase}"}} {hist.total}')
+                lines.append(f'{name}_count{{phase="{phase}"}} {hist.count}')
+            quantiles = [(phase, hist.quantiles()) for phase, hist in histograms]
+
+        name = f"{self.prefix}_phase_recent_seconds"
+        lines += [
+            f"# HELP {name} Quantiles of the most recent durations.",
+            f"# TYPE {name} summary",
+        ]
+        for phase, values in quantiles:
+            for q, value in zip(QUANTILES, values):
+                lines.append(f'{name}{{phase="{phase}",quantile="{q}"}} {value}')
+
+        for gauge, (help_text, func) in sorted(self._gauges.items()):
+            name = f"{self.prefix}_{gauge}"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            for key, value in func().items():
+                lines.append(f'{name}{{key="{key}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+def install(server: Flask, metrics: Metrics) -> None:
+    """
+    リクエストごとの処理時間の記録、/metrics、プロファイルの保存を server に追加する
+
+    プロファイル（cProfile）は次の場合に取る
+        - 環境変数 PROFILE_QUERY=1 の時、クエリに profile=1 が付いたリクエスト
+          （誰でも付けられるので、既定では無視する）
+        - 環境変数 PROFILE_SAMPLE（0〜1）の割合で選んだリクエスト
+    PROFILE_SLOW_MS（既定値 0）より時間のかかったものを PROFILE_DIR（既定値 profiles）に保存する
+    ファイル名にはプロセスIDと連番を付け、同じ秒のプロファイルが上書きされないようにする
+    """
+    sample = float(os.environ.get("PROFILE_SAMPLE", 0))
+    allow_query = os.environ.get("PROFILE_QUERY") == "1"
+    sequence = itertools.count()
+    slow_sec = float(os.environ.get("PROFILE_SLOW_MS", 0)) / 1000
+    profile_dir = os.environ.get("PROFILE_DIR", "profiles")
+
+    @server.route("/metrics")
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    @server.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        g.profiler = None
+        requested = allow_query and request.args.get("profile") == "1"
+        if requested or (sample and random.random() < sample):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @server.after_request
+    def stop_timer(response):
+        start = g.get("request_start")
+        if start is None:
+            return response
+        sec = time.perf_counter() - start
+        rule = request.url_rule.rule if request.url_rule else "unknown"
+        metrics.observe(f"http {request.method} {rule}", sec)
+
+        profiler = g.get("profiler")
+        if profiler is not None:
+            profiler.disable()
+            if sec >= slow_sec:
+                os.makedirs(profile_dir, exist_ok=True)
+                name = rule.strip("/").replace("/", "_").replace("<", "").replace(">", "")
+                path = os.path.join(
+                    profile_dir,
+                    f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(sequence)}"
+                    f"-{name or 'root'}.prof",
+                )
+                profiler.dump_stats(path)
+        return response
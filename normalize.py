@@ -0,0 +1,93 @@
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+"""
+    年代、性別、和暦の日付の正規化
+    列の値の種類は行数に比べてとても少ないので、ユニークな値だけを正規化し、
+    結果をコードを通して全ての行に戻す
+"""
+
+REIWA_PATTERN = r"^令和(\d+|元)年(\d+)月(\d+)日"
+
+
+def map_unique(series: pd.Series, func: Callable) -> pd.Categorical:
+    """
+    series のユニークな値にだけ func を適用し、カテゴリ型で返す
+    Params:
+        series: 正規化する列
+        func: 値を1つ受け取り正規化した値（または None）を返す関数
+    Returns:
+        categorical: series と同じ長さのカテゴリ型
+    """
+    codes, uniques = pd.factorize(series)
+    return _broadcast(codes, pd.Series(uniques).map(func))
+
+
+def _broadcast(codes: np.ndarray, normalized: pd.Series) -> pd.Categorical:
+    """
+    ユニークな値ごとの正規化結果を、元の行のコードで全ての行に戻す
+    """
+    new_codes, categories = pd.factorize(normalized, sort=True)
+    # 欠損値（コード -1）の行は -1 のままにする
+    lookup = np.append(new_codes, -1)
+    return pd.Categorical.from_codes(lookup[codes], categories=categories)
+
+
+def replace_all(series: pd.Series, replace_dict: Dict[str, str]) -> pd.Categorical:
+    """
+    replace_dict の置き換えを順番に行う（str.replace を辞書の順に適用するのと同じ結果）
+    """
+
+    def replace(value):
+        for k, v in replace_dict.items():
+            value = value.replace(k, v)
+        return value
+
+    return map_unique(series.astype("string"), replace)
+
+
+def split_age_sex(
+    series: pd.Series, replace_dict: Dict[str, str]
+) -> Tuple[pd.Categorical, pd.Categorical, pd.Categorical]:
+    """
+    「20代男性」のような列を置き換えた上で、年代と性別に分ける
+    Returns:
+        age_sex: 置き換え後の列
+        age: 年代（末尾の2文字以外）
+        sex: 性別（末尾の2文字）
+    """
+    age_sex = replace_all(series, replace_dict)
+    categories = pd.Series(age_sex.categories)
+    age = _broadcast(age_sex.codes, categories.str[:-2])
+    sex = _broadcast(age_sex.codes, categories.str[-2:])
+    return age_sex, age, sex
+
+
+def map_age(series: pd.Series, age_dict: Dict[str, str]) -> pd.Categorical:
+    """
+    年代を age_dict で置き換える。辞書にない値は欠損にする
+    """
+    codes, uniques = pd.factorize(series)
+    normalized = pd.Series(uniques).astype(str).map(age_dict)
+    return _broadcast(codes, normalized)
+
+
+def wareki_to_datetime(series: pd.Series) -> pd.Series:
+    """
+    令和の和暦（令和〇年〇月〇日）を西暦の日付に変換する
+    令和でない値は NaT にする
+    """
+    codes, uniques = pd.factorize(series)
+    parts = pd.Series(uniques).astype(str).str.extract(REIWA_PATTERN)
+    ymd = pd.DataFrame(
+        {
+            "year": parts[0].replace("元", "1").astype(float) + 2018,
+            "month": parts[1].astype(float),
+            "day": parts[2].astype(float),
+        }
+    )
+    dates = pd.to_datetime(ymd, errors="coerce")
+    values = np.append(dates.to_numpy(dtype="datetime64[ns]"), np.datetime64("NaT"))
+    return pd.Series(values[codes], index=series.index)
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import pickle
+from typing import NamedTuple, Optional
+
+import pandas as pd
+
+
+class Page(NamedTuple):
+    """
+    取得したページ
+    url: ページのURL
+    text: HTML
+    digest: HTMLのハッシュ
+    changed: 前回キャッシュした内容から変わっているか
+    """
+
+    url: str
+    text: str
+    digest: str
+    changed: bool
+
+
+class PageCache:
+    """
+    URLごとにページの内容、ETag、Last-Modified、内容のハッシュを保存するキャッシュ
+    ページを読み込んだデータフレームも、内容のハッシュとともに保存する
+
+    Params:
+        cache_dir: キャッシュを保存するディレクトリ
+    """
+
+    def __init__(self, cache_dir: str = "data/page_cache"):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, url: str, suffix: str) -> str:
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def _write(self, path: str, data: bytes) -> None:
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def meta(self, url: str) -> Optional[dict]:
+        try:
+            with open(self._path(url, ".json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self, url: str) -> Optional[Page]:
+        """
+        キャッシュしたページを返す（changed は False）
+        """
+        meta = self.meta(url)
+        if meta is None:
+            return None
+        try:
+            with open(self._path(url, ".html"), encoding="utf-8") as f:
+                text = f.read()
+        except OSError:
+            return None
+        return Page(url, text, meta["digest"], False)
+
+    def validators(self, url: str) -> dict:
+        """
+        条件付きリクエストに付けるヘッダー
+        """
+        meta = self.meta(url)
+        headers = dict()
+        if meta is None:
+            return headers
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def store(self, url: str, text: str, etag: str, last_modified: str) -> Page:
+        """
+        ページを保存し、前回の内容から変わっているかを返す
+        """
+        old = self.meta(url)
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        changed = old is None or old["digest"] != digest
+        if changed:
+            self._write(self._path(url, ".html"), text.encode("utf-8"))
+        meta = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "digest": digest,
+        }
+        self._write(self._path(url, ".json"), json.dumps(meta).encode())
+        return Page(url, text, digest, changed)
+
+    def load_frame(self, page: Page) -> Optional[pd.DataFrame]:
+        """
+        page と同じ内容から作ったデータフレームがあれば返す
+        pickle は pandas のバージョンが変わると読めなくなる（AttributeError なども起きる）ので、
+        読めないものは何であれ保存されていないものとして扱い、ページを読み込み直させる
+        """
+        try:
+            with open(self._path(page.url, ".pkl"), "rb") as f:
+                digest, df = pickle.load(f)
+        except Exception:
+            return None
+        return df if digest == page.digest else None
+
+    def store_frame(self, page: Page, df: pd.DataFrame) -> None:
+        self._write(self._path(page.url, ".pkl"), pickle.dumps((page.digest, df)))
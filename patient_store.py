@@ -0,0 +1,141 @@
+import json
+import os
+import shutil
+from datetime import datetime
+from typing import Dict, Optional
+
+import pandas as pd
+
+"""
+    感染者データを月ごとのCSVに分けて保存する
+    data/patients/2021-09.csv のように発表日の月ごとに分け、新しい行は追記するだけにする
+    manifest.json には最新の日付、日付ごとの感染者数、パーティションごとの行数を持つ
+    事例（事例番号）をキーとし、すでにある事例は追記しない
+"""
+
+KEY = "事例"
+UNKNOWN_PARTITION = "unknown"
+
+
+def _partition(dates: pd.Series) -> pd.Series:
+    return dates.dt.strftime("%Y-%m").fillna(UNKNOWN_PARTITION)
+
+
+def _unshare(path: str) -> None:
+    """
+    ハードリンクで他のディレクトリ（前のバンドルなど）と共有しているファイルは、
+    追記で共有先を書き換えないように自分だけのコピーに置き換える
+    """
+    if os.stat(path).st_nlink <= 1:
+        return
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.copy2(path, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class PatientStore:
+    """
+    月ごとに分けた感染者データと、その集計（manifest.json）
+
+    Params:
+        root: パーティションを置くディレクトリ
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.root, "manifest.json")
+
+    def partition_path(self, name: str) -> str:
+        return os.path.join(self.root, f"{name}.csv")
+
+    def _load_manifest(self) -> Dict:
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"latest_date": None, "counts": {}, "partitions": {}}
+
+    def _save_manifest(self) -> None:
+        tmp_path = f"{self.manifest_path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    @property
+    def latest_date(self) -> Optional[datetime]:
+        latest = self.manifest["latest_date"]
+        return None if latest is None else datetime.fromisoformat(latest)
+
+    def count(self, date: datetime) -> int:
+        """
+        保存している date の感染者数
+        """
+        return self.manifest["counts"].get(date.strftime("%Y-%m-%d"), 0)
+
+    def _known_keys(self, name: str) -> set:
+        path = self.partition_path(name)
+        if not os.path.exists(path):
+            return set()
+        keys = pd.read_csv(path, usecols=[KEY], dtype={KEY: str})[KEY]
+        return set(keys)
+
+    def upsert(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        df のうち保存していない事例だけを、該当する月のファイルに追記する
+        読み込むのは df に含まれる月のファイルの事例の列だけ
+        Params:
+            df: 事例、date 列を持つデータフレーム
+        Returns:
+            new_rows: 追記した行
+        """
+        df = df.drop_duplicates(subset=KEY, keep="last")
+        partitions = _partition(df["date"])
+        appended = list()
+        for name, part in df.groupby(partitions, sort=True):
+            known = self._known_keys(name)
+            new_rows = part[~part[KEY].astype(str).isin(known)]
+            if new_rows.empty:
+                continue
+            new_rows = new_rows.sort_values("date")
+            path = self.partition_path(name)
+            exists = os.path.exists(path)
+            if exists:
+                _unshare(path)
+            columns = self.manifest.get("columns")
+            if columns is not None:
+                new_rows = new_rows.reindex(columns=columns)
+            else:
+                self.manifest["columns"] = list(new_rows.columns)
+            new_rows.to_csv(path, mode="a", header=not exists, index=None)
+            self.manifest["partitions"][name] = (
+                self.manifest["partitions"].get(name, 0) + len(new_rows)
+            )
+            appended.append(new_rows)
+
+        if not appended:
+            return df.iloc[:0]
+        new_data = pd.concat(appended)
+        counts = new_data["date"].dropna().dt.strftime("%Y-%m-%d").value_counts()
+        for day, num in counts.items():
+            self.manifest["counts"][day] = self.manifest["counts"].get(day, 0) + int(num)
+        if self.manifest["counts"]:
+            self.manifest["latest_date"] = max(self.manifest["counts"])
+        self._save_manifest()
+        return new_data
+
+    def load(self) -> pd.DataFrame:
+        """
+        全てのパーティションを読み込む
+        """
+        frames = [
+            pd.read_csv(self.partition_path(name), parse_dates=["date"])
+            for name in sorted(self.manifest["partitions"])
+        ]
+        if not frames:
+            return pd.DataFrame(columns=self.manifest.get("columns", [KEY, "date"]))
+        return pd.concat(frames).sort_values("date").reset_index(drop=True)
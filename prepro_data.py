@@ -1,6 +1,10 @@
-import requests
 import pandas as pd
 
+from fetcher import Fetcher
+from json_stream import iso_dates, iter_items, read_columns, text_chunks
+from normalize import split_age_sex
+from snapshot import write_snapshot
+
 
 """
     データの持つ属性
@@ -15,13 +19,51 @@ import pandas as pd
 """
 
 
-def _get_data_from_kyoto_covid(url):
-    r = requests.get(url)
-    print(r.status_code)
-    res = r.json()
-    df = pd.DataFrame(res["data"])
-    df["date"] = df["リリース日"].map(lambda x: x.split("T")[0])
-    df["date"] = pd.to_datetime(df["date"])
+## 受け取る時の1回の読み込みの大きさ（バイト）
+CHUNK_BYTES = 1 << 16
+
+PATIENTS_URL = "https://raw.githubusercontent.com/stop-covid19-kyoto/covid19-kyoto/development/data/patients.json"
+
+# 年代と性別の置き換え用辞書
+REPLACE_DICT = {
+    "2代": "20代",
+    " ": "",
+    "―": "不明",
+    "－代": "不明",
+    "園児": "10代未満不明",
+    "10未満男性": "10代未満男性",
+    "10未満女性": "10代未満女性",
+    "調査中代": "不明",
+    "不明代": "不明",
+    "調査中代": "不明",
+    "6代": "60代",
+}
+
+
+def _get_data_from_kyoto_covid(url, fetcher: Fetcher = None):
+    if fetcher is None:
+        fetcher = Fetcher()
+    # 受け取りながら読むので、ファイル全体の文字列は作らない
+    r = fetcher.get(url, stream=True)
+    r.encoding = r.encoding or "utf-8"
+    return _read_patients(r.iter_content(CHUNK_BYTES, decode_unicode=True))
+
+
+def _parse_patients(text: str) -> pd.DataFrame:
+    """
+    patients.json の文字列をデータフレームにする
+    """
+    return _read_patients(text_chunks(text))
+
+
+def _read_patients(chunks) -> pd.DataFrame:
+    """
+    patients.json の data の要素を1件ずつ列に貯めてデータフレームにする
+    （json.loads で全体を辞書のリストにしてからデータフレームにすると、メモリを何倍も使う）
+    日付は「リリース日」の先頭10文字（2020-01-30T...）から作る
+    """
+    df = read_columns(iter_items(chunks, "data"))
+    df["date"] = iso_dates(df["リリース日"])
     return df
 
 
@@ -32,30 +74,14 @@ def _get_data_from_kyoto_covid(url):
 
 
 def _data_prepro(df, replace_dict):
-    for k, v in replace_dict.items():
-        df["年代と性別"] = df["年代と性別"].str.replace(k, v)
-
-    df["age"] = df["年代と性別"].map(lambda x: x[:-2])
-    df["sex"] = df["年代と性別"].map(lambda x: x[-2:])
+    # 置き換えと分割はユニークな値に対してだけ行う
+    df["年代と性別"], df["age"], df["sex"] = split_age_sex(df["年代と性別"], replace_dict)
     return df
 
 
 if __name__ == "__main__":
-    url = "https://raw.githubusercontent.com/stop-covid19-kyoto/covid19-kyoto/development/data/patients.json"
-    replace_dict = {
-        "2代": "20代",
-        " ": "",
-        "―": "不明",
-        "－代": "不明",
-        "園児": "10代未満不明",
-        "10未満男性": "10代未満男性",
-        "10未満女性": "10代未満女性",
-        "調査中代": "不明",
-        "不明代": "不明",
-        "調査中代": "不明",
-        "6代": "60代",
-    }
-    df = _get_data_from_kyoto_covid(url)
-    df = _data_prepro(df, replace_dict)
+    df = _get_data_from_kyoto_covid(PATIENTS_URL)
+    df = _data_prepro(df, REPLACE_DICT)
     df.to_csv("data/kyoto_patients.csv", index=None)
+    write_snapshot(df, "data/kyoto_patients.csv")
     print(df)
@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, NamedTuple
+
+from data_store import DataStore
+
+"""
+    複数の地域（都道府県や市）のデータ
+    data/regions/<地域名>/patients.csv のように地域ごとにディレクトリを分け、
+    region.json があれば {"label": "表示名"} を読む
+    地域ごとの集計は最初にアクセスされた時にバックグラウンドで作り、
+    保持する地域の数を上限までに抑える（最近使われていないものから捨てる）
+"""
+
+PATIENTS_FILE = "patients.csv"
+
+
+class Region(NamedTuple):
+    name: str
+    label: str
+    path: str
+
+
+def load_regions(regions_dir: str) -> Dict[str, Region]:
+    """
+    regions_dir の下の、感染者データのあるディレクトリを地域として読み込む
+    """
+    regions = dict()
+    for name in sorted(os.listdir(regions_dir)):
+        path = os.path.join(regions_dir, name, PATIENTS_FILE)
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(os.path.join(regions_dir, name, "region.json")) as f:
+                label = json.load(f).get("label", name)
+        except (OSError, ValueError):
+            label = name
+        regions[name] = Region(name, label, path)
+    return regions
+
+
+class RegionStores:
+    """
+    地域ごとの DataStore を、最近使われた順に max_regions 個まで保持する
+
+    Params:
+        regions: 地域名ごとの Region
+        make_build: Region を受け取り、DataStore に渡す build 関数を返す関数
+        max_regions: 保持する地域の数の上限（pinned の地域は数えない）
+        interval: データファイルの更新を確認する間隔（秒）
+        pinned: 捨てない地域と、その DataStore（起動時に読み込むものなど）
+    """
+
+    def __init__(
+        self,
+        regions: Dict[str, Region],
+        make_build: Callable[[Region], Callable[[str, str, Any], Any]],
+        max_regions: int = 4,
+        interval: float = 60,
+        pinned: Dict[str, DataStore] = None,
+    ):
+        self.regions = regions
+        self.make_build = make_build
+        self.max_regions = max_regions
+        self.interval = interval
+        self.pinned = dict(pinned or {})
+        self.evictions = 0
+        self._stores = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.regions
+
+    def get(self, name: str) -> DataStore:
+        """
+        地域の DataStore。初めてならバックグラウンドで集計を始める（その間 current は None）
+        Raises:
+            KeyError: 設定されていない地域
+        """
+        if name in self.pinned:
+            return self.pinned[name]
+        region = self.regions[name]
+        with self._lock:
+            store = self._stores.get(name)
+            if store is not None:
+                self._stores.move_to_end(name)
+                return store
+            store = DataStore(
+                region.path, self.make_build(region), interval=self.interval, lazy=True
+            )
+            self._stores[name] = store
+            while len(self._stores) > self.max_regions:
+                self._stores.popitem(last=False)
+                self.evictions += 1
+            return store
+
+    def loaded(self) -> List[str]:
+        with self._lock:
+            return list(self.pinned) + list(self._stores)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "regions": len(self.regions),
+                "loaded": len(self.pinned) + len(self._stores),
+                "max_regions": self.max_regions,
+                "evictions": self.evictions,
+            }
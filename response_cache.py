@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import Flask, Response, g, request
+
+from figure_cache import FigureCache
+
+"""
+    Dash のコールバック（/_dash-update-component）のレスポンスのキャッシュ
+    サーバー側のコールバックの結果は、データのバージョンと入力値が同じなら変わらないので、
+    (コードとデータのバージョン, 入力値) のハッシュをキーにしてレスポンスの本文を保存し、次からはコールバックを呼ばずに返す
+    保存先はプロセス内（MemoryStore）か、gunicorn の全てのワーカーで共有する sqlite（SqliteStore）
+    データのバージョンは scope（地域など）ごとに持ち、変わると古いバージョンのものは捨てる
+
+    レスポンスには ETag（キーのハッシュ）を付け、If-None-Match が一致すれば 304 を返す
+    （Dash のブラウザ側は POST の結果を再利用しないので、主に API として使うクライアント向け）
+"""
+
+## コールバックのリクエストのパス（routes_pathname_prefix の後ろ）
+CALLBACK_PATH = "_dash-update-component"
+
+
+class MemoryStore:
+    """
+    プロセス内に保存する（FigureCache の LRU を使う）
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.cache = FigureCache(max_bytes)
+
+    def get(self, scope: str, version: str, key: str) -> Optional[bytes]:
+        self.cache.set_version(version, scope)
+        return self.cache.get((version, key))
+
+    def put(self, scope: str, version: str, key: str, body: bytes) -> None:
+        self.cache.set_version(version, scope)
+        self.cache.put((version, key), body)
+
+    def stats(self) -> Dict:
+        return self.cache.stats()
+
+
+class SqliteStore:
+    """
+    sqlite のファイルに保存する。同じファイルを指定したプロセスの間で共有される
+
+    Params:
+        path: データベースのファイル
+        max_rows: 保存するレスポンスの数の上限（古く保存されたものから捨てる）
+    """
+
+    def __init__(self, path: str, max_rows: int = 10000):
+        self.path = path
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._versions = dict()
+        self._local = threading.local()
+        # import 時（gunicorn --preload なら master）に開いた接続はワーカーに引き継がないよう閉じる
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, scope TEXT, version TEXT, body BLOB, created REAL)"
+                )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite の接続はスレッドをまたいでも、fork したプロセスをまたいでも使えないので、
+        # スレッドとプロセスIDごとに作る
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, pid
+        return self._local.conn
+
+    def _set_version(self, conn: sqlite3.Connection, scope: str, version: str) -> None:
+        """
+        このプロセスで scope のバージョンが変わったのを初めて見た時に、他のバージョンのものを捨てる
+        """
+        if self._versions.get(scope) == version:
+            return
+        self._versions[scope] = version
+        with conn:
+            conn.execute(
+                "DELETE FROM responses WHERE scope = ? AND version != ?", (scope, version)
+            )
+
+    def get(self, scope: str, version: str, key: str) -> Optional[bytes]:
+        conn = self._connect()
+        self._set_version(conn, scope, version)
+        row = conn.execute("SELECT body FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, scope: str, version: str, key: str, body: bytes) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, scope, version, body, time.time()),
+            )
+        self._puts += 1
+        if self._puts % 256 == 0:
+            with conn:
+                conn.execute(
+                    "DELETE FROM responses WHERE key NOT IN "
+                    "(SELECT key FROM responses ORDER BY created DESC LIMIT ?)",
+                    (self.max_rows,),
+                )
+
+    def stats(self) -> Dict:
+        rows, size = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM responses"
+        ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "items": rows, "bytes": size}
+
+
+def make_store():
+    """
+    環境変数 RESPONSE_CACHE_DB があれば sqlite、なければプロセス内に保存する
+    """
+    path = os.environ.get("RESPONSE_CACHE_DB")
+    if path:
+        return SqliteStore(path, int(os.environ.get("RESPONSE_CACHE_ROWS", 10000)))
+    return MemoryStore(int(os.environ.get("RESPONSE_CACHE_MB", 32)) * 1024 * 1024)
+
+
+def code_version(root: str) -> str:
+    """
+    アプリケーションのコードのバージョン。環境変数 APP_VERSION（デプロイしたコミットなど）があればそれ、
+    なければ root 直下の .py ファイルの内容のハッシュ（起動時に一度だけ計算する）
+    sqlite のキャッシュは再起動しても残るので、コードが変わったら前のコードのレスポンスを返さないようにする
+    """
+    version = os.environ.get("APP_VERSION")
+    if version:
+        return version
+    sha = hashlib.sha1()
+    for name in sorted(os.listdir(root)):
+        if name.endswith(".py"):
+            sha.update(name.encode("utf-8"))
+            with open(os.path.join(root, name), "rb") as f:
+                sha.update(f.read())
+    return sha.hexdigest()[:12]
+
+
+def request_key(payload: Dict, version: str) -> str:
+    """
+    出力、入力値、State、変更された入力（triggered_id に使われる）とデータのバージョンのハッシュ
+    """
+    parts = {
+        "version": version,
+        "output": payload.get("output"),
+        "inputs": payload.get("inputs"),
+        "state": payload.get("state"),
+        "changed": payload.get("changedPropIds"),
+    }
+    data = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def install(
+    server: Flask,
+    store,
+    version_for: Callable[[Dict], Optional[Tuple[str, str]]],
+    observe: Optional[Callable[[str, float], None]] = None,
+    app_version: str = "",
+) -> None:
+    """
+    server のコールバックのリクエストに、レスポンスのキャッシュを追加する
+    Params:
+        server: Dash の Flask
+        store: MemoryStore か SqliteStore
+        version_for: リクエストの内容（JSON）を受け取り、(scope, データのバージョン) を返す関数。
+                     データの読み込み中など、キャッシュしない場合は None を返す
+        observe: (処理名, 秒) を受け取り、キャッシュから返すのにかかった時間を記録する関数
+        app_version: コードのバージョン（code_version）。データのバージョンと合わせてキーにする
+    """
+
+    @server.before_request
+    def cached_callback():
+        g.response_cache = None
+        if request.method != "POST" or not request.path.endswith(CALLBACK_PATH):
+            return None
+        start = time.perf_counter()
+        payload = request.get_json(silent=True)
+        target = version_for(payload) if isinstance(payload, dict) else None
+        if target is None:
+            return None
+        scope, version = target
+        # コードが変わった時も、データが変わった時と同じく前のレスポンスを捨てる
+        version = f"{app_version}:{version}"
+        key = request_key(payload, version)
+        headers = {"ETag": f'"{key}"', "Cache-Control": "no-cache"}
+        if headers["ETag"] in request.headers.get("If-None-Match", ""):
+            return Response(status=304, headers=headers)
+        body = store.get(scope, version, key)
+        if body is None:
+            g.response_cache = (scope, version, key)
+            return None
+        if observe is not None:
+            observe("response_cache.hit", time.perf_counter() - start)
+        return Response(body, mimetype="application/json", headers=headers)
+
+    @server.after_request
+    def store_callback(response):
+        target = g.get("response_cache")
+        # 204（PreventUpdate）やエラー、圧縮済みのレスポンスは保存しない
+        if (
+            target is None
+            or response.status_code != 200
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+        scope, version, key = target
+        store.put(scope, version, key, response.get_data())
+        response.headers["ETag"] = f'"{key}"'
+        response.headers["Cache-Control"] = "no-cache"
+        return response
@@ -0,0 +1,208 @@
+import json
+import os
+import shutil
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from data_store import file_digest
+
+"""
+    CSVと同じ内容を列ごとの .npy ファイルとして保存したもの（スナップショット）
+    data/kyoto_patients.csv なら data/kyoto_patients.snapshot/ に以下を置く
+    date.npy: int32 1970-01-01 からの日数（欠損は NAT_DAY）
+    age.npy, sex.npy: int16 カテゴリのコード（欠損は -1）
+    meta.json: 行数、カテゴリの一覧、元のCSVのハッシュ
+    読み込み時はメモリマップで開くので、各ワーカーでページが共有される
+"""
+
+NAT_DAY = np.iinfo(np.int32).min
+SNAPSHOT_COLUMNS = ["date", "age", "sex"]
+
+
+def snapshot_path(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + ".snapshot"
+
+
+class Snapshot:
+    """
+    スナップショットの列（メモリマップされた配列）とカテゴリの一覧
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], categories: Dict[str, List]):
+        self.columns = columns
+        self.categories = categories
+
+    def __len__(self) -> int:
+        return len(self.columns["date"])
+
+    def dates(self) -> pd.Series:
+        days = np.asarray(self.columns["date"])
+        dates = days.astype("datetime64[D]")
+        dates[days == NAT_DAY] = np.datetime64("NaT")
+        return pd.Series(dates.astype("datetime64[ns]"))
+
+    def categorical(self, name: str) -> pd.Categorical:
+        return pd.Categorical.from_codes(
+            self.columns[name], categories=self.categories[name]
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        df = pd.DataFrame({"date": self.dates()})
+        for name in self.categories:
+            df[name] = self.categorical(name)
+        return df
+
+
+def write_snapshot(df: pd.DataFrame, csv_path: str) -> str:
+    """
+    保存済みのCSVに対応するスナップショットを書き出す
+    CSVを書き込んだ後に呼ぶこと（CSVのハッシュを記録するため）
+    Params:
+        df: date 列と age, sex などのカテゴリ列を持つデータフレーム
+        csv_path: 書き込んだCSVへのパス
+    Returns:
+        path: スナップショットのディレクトリ
+    """
+    path = snapshot_path(csv_path)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    days = pd.to_datetime(df["date"]).to_numpy(dtype="datetime64[D]")
+    nat = np.isnat(days)
+    days = days.astype("int64")
+    days[nat] = NAT_DAY
+    np.save(os.path.join(tmp_path, "date.npy"), days.astype(np.int32))
+
+    categories = dict()
+    for name in SNAPSHOT_COLUMNS[1:]:
+        if name not in df.columns:
+            continue
+        codes, uniques = pd.factorize(df[name], sort=True)
+        np.save(os.path.join(tmp_path, f"{name}.npy"), codes.astype(np.int16))
+        categories[name] = [str(u) for u in uniques]
+
+    meta = {
+        "rows": len(df),
+        "categories": categories,
+        "source_digest": file_digest(csv_path),
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    old_path = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return path
+
+
+def _append_npy(path: str, values: np.ndarray) -> bool:
+    """
+    1次元の .npy ファイルの末尾に values を書き足し、ヘッダーの行数を書き換える
+    ヘッダーに行数の桁が増える余裕がない、または dtype が違う場合は何もせず False を返す
+    """
+    with open(path, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        if version != (1, 0):
+            return False
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        data_start = f.tell()
+        if len(shape) != 1 or dtype != values.dtype:
+            return False
+        header = "{'descr': %r, 'fortran_order': %r, 'shape': (%d,), }" % (
+            np.lib.format.dtype_to_descr(dtype),
+            fortran_order,
+            shape[0] + len(values),
+        )
+        # マジックナンバー（6バイト）、バージョン（2バイト）、ヘッダーの長さ（2バイト）の後がヘッダー
+        space = data_start - 10 - 1
+        if len(header) > space:
+            return False
+        f.seek(data_start + shape[0] * dtype.itemsize)
+        f.write(values.tobytes())
+        f.seek(10)
+        f.write((header.ljust(space) + "\n").encode("latin1"))
+    return True
+
+
+def append_snapshot(df: pd.DataFrame, csv_path: str, digest: Optional[str]) -> str:
+    """
+    CSVに追記した行だけをスナップショットの列に書き足す（全ての行を読み直さない）
+    追記する前のCSVとスナップショットが対応していなければ、または新しいカテゴリがあれば、
+    CSVを読み直して全体を書き出す
+    Params:
+        df: 追記した行（date 列とカテゴリ列）
+        csv_path: 追記したCSV
+        digest: 追記する前のCSVのハッシュ（file_digest。CSVがなかった場合は None）
+    Returns:
+        path: スナップショットのディレクトリ
+    """
+    path = snapshot_path(csv_path)
+    meta_path = os.path.join(path, "meta.json")
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = None
+    columns = None
+    if meta is not None and digest is not None and meta.get("source_digest") == digest:
+        days = pd.to_datetime(df["date"]).to_numpy(dtype="datetime64[D]")
+        nat = np.isnat(days)
+        days = days.astype("int64")
+        days[nat] = NAT_DAY
+        columns = {"date": days.astype(np.int32)}
+        for name, categories in meta["categories"].items():
+            lookup = {c: i for i, c in enumerate(categories)}
+            values = df[name].astype(object)
+            codes = [-1 if pd.isna(v) else lookup.get(str(v)) for v in values]
+            if any(code is None for code in codes):
+                columns = None
+                break
+            columns[name] = np.array(codes, dtype=np.int16)
+    if columns is not None:
+        # 途中で失敗しても、行数が meta.json と合わなければ読み込まれないので壊れたものは使われない
+        if all(
+            _append_npy(os.path.join(path, f"{name}.npy"), values)
+            for name, values in columns.items()
+        ):
+            meta["rows"] += len(df)
+            meta["source_digest"] = file_digest(csv_path)
+            tmp_path = f"{meta_path}.tmp-{os.getpid()}"
+            with open(tmp_path, "w") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_path, meta_path)
+            return path
+    return write_snapshot(pd.read_csv(csv_path, parse_dates=["date"]), csv_path)
+
+
+def load_snapshot(
+    path: str, csv_path: Optional[str] = None, mmap: bool = True
+) -> Optional[Snapshot]:
+    """
+    スナップショットを読み込む
+    Params:
+        path: スナップショットのディレクトリ
+        csv_path: 元のCSV。指定した場合、内容が書き出し時と違えば None を返す
+        mmap: メモリマップで開くか
+    Returns:
+        snapshot: 読み込めなければ None
+    """
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if csv_path is not None and meta["source_digest"] != file_digest(csv_path):
+            return None
+        mmap_mode = "r" if mmap else None
+        columns = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in ["date"] + list(meta["categories"])
+        }
+    except (OSError, ValueError, KeyError):
+        return None
+    if any(len(col) != meta["rows"] for col in columns.values()):
+        return None
+    return Snapshot(columns, meta["categories"])
@@ -0,0 +1,73 @@
+import gzip
+from typing import NamedTuple, Optional
+
+import plotly.graph_objects as go
+from flask import Request, Response
+
+try:
+    import brotli
+except ImportError:  # brotli がなければ gzip だけを使う
+    brotli = None
+
+"""
+    データのバージョンごとに変わらないグラフを、一度だけJSONにして圧縮しておく
+    ETag を付けて返すので、ブラウザやCDNは変わっていなければ 304 で済む
+"""
+
+CACHE_CONTROL = "public, no-cache"
+
+
+class StaticFigure(NamedTuple):
+    """
+    圧縮済みのグラフのJSON
+    """
+
+    etag: str
+    body: bytes
+    gzip: bytes
+    br: Optional[bytes]
+
+
+def compress_figure(
+    fig: go.Figure, version: str, name: str, code_version: str = ""
+) -> StaticFigure:
+    """
+    グラフをJSONにして gzip（と brotli）で圧縮する
+    Params:
+        fig: グラフ
+        version: データのバージョン（ETag に使う）
+        name: グラフの名前
+        code_version: コードのバージョン（response_cache.code_version）。
+                      データが同じでもグラフの描き方が変われば ETag を変える
+    """
+    body = fig.to_json().encode("utf-8")
+    return StaticFigure(
+        etag=f'"{name}-{code_version}-{version}"',
+        body=body,
+        gzip=gzip.compress(body, compresslevel=9),
+        br=brotli.compress(body) if brotli is not None else None,
+    )
+
+
+def figure_response(figure: StaticFigure, request: Request) -> Response:
+    """
+    If-None-Match が一致すれば 304、そうでなければ Accept-Encoding に合わせて圧縮したものを返す
+    """
+    headers = {
+        "ETag": figure.etag,
+        "Cache-Control": CACHE_CONTROL,
+        "Vary": "Accept-Encoding",
+    }
+    if figure.etag in request.headers.get("If-None-Match", ""):
+        return Response(status=304, headers=headers)
+
+    accept = request.headers.get("Accept-Encoding", "")
+    if figure.br is not None and "br" in accept:
+        body = figure.br
+        headers["Content-Encoding"] = "br"
+    elif "gzip" in accept:
+        body = figure.gzip
+        headers["Content-Encoding"] = "gzip"
+    else:
+        body = figure.body
+    return Response(body, mimetype="application/json", headers=headers)
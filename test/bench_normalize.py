@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from chomoku_get import replace_dict as age_dict
+from normalize import map_age, split_age_sex, wareki_to_datetime
+
+"""
+    年代・性別・和暦の正規化の速度を、以前の行ごとの処理と比べる
+    data/kyoto_covid2.csv の全行から、スクレイピング直後の形の列を作って計測する
+    使い方: python bench_normalize.py [繰り返し回数]
+"""
+
+PREPRO_REPLACE = {
+    "2代": "20代",
+    " ": "",
+    "―": "不明",
+    "－代": "不明",
+    "園児": "10代未満不明",
+    "10未満男性": "10代未満男性",
+    "10未満女性": "10代未満女性",
+    "調査中代": "不明",
+    "不明代": "不明",
+    "6代": "60代",
+}
+
+
+def make_raw(path: str) -> pd.DataFrame:
+    df = pd.read_csv(path, parse_dates=["date"])
+    rng = np.random.default_rng(0)
+    sex = rng.choice(["男性", "女性"], len(df))
+    raw = pd.DataFrame()
+    raw["年代と性別"] = df["age"].fillna("調査中代") + sex
+    raw["年代"] = df["age"].fillna("調査中").str.replace("代", "")
+    raw["発表日"] = (
+        "令和"
+        + (df["date"].dt.year - 2018).astype(str)
+        + "年"
+        + df["date"].dt.month.astype(str)
+        + "月"
+        + df["date"].dt.day.astype(str)
+        + "日"
+    )
+    return raw
+
+
+def _old_wareki(date_str):
+    if date_str[:2] == "令和":
+        dt_str = date_str[2:].split("年")
+        dt_year = 2018 + int(dt_str[0])
+        dt_str = dt_str[1].split("月")
+        dt_month = int(dt_str[0])
+        dt_day = int(dt_str[1].split("日")[0])
+        return pd.Timestamp(dt_year, dt_month, dt_day)
+
+
+def old_path(raw: pd.DataFrame) -> pd.DataFrame:
+    age_sex = raw["年代と性別"]
+    for k, v in PREPRO_REPLACE.items():
+        age_sex = age_sex.str.replace(k, v)
+    return pd.DataFrame(
+        {
+            "age_sex": age_sex,
+            "age": age_sex.map(lambda x: x[:-2]),
+            "sex": age_sex.map(lambda x: x[-2:]),
+            "age_group": raw["年代"].map(age_dict),
+            "date": raw["発表日"].map(_old_wareki),
+        }
+    )
+
+
+def new_path(raw: pd.DataFrame) -> pd.DataFrame:
+    age_sex, age, sex = split_age_sex(raw["年代と性別"], PREPRO_REPLACE)
+    return pd.DataFrame(
+        {
+            "age_sex": age_sex,
+            "age": age,
+            "sex": sex,
+            "age_group": map_age(raw["年代"], age_dict),
+            "date": wareki_to_datetime(raw["発表日"]),
+        },
+        index=raw.index,
+    )
+
+
+def aligned(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    カテゴリ型と object の違い、日付の単位の違いを揃える（欠損は "nan" と NaT になる）
+    """
+    df = df.astype(object).astype(str)
+    df["date"] = pd.to_datetime(df["date"].replace({"None": None, "NaT": None}))
+    return df
+
+
+def timeit(func, raw, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(raw)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    path = os.path.join(os.path.dirname(__file__), "..", "data", "kyoto_covid2.csv")
+    raw = make_raw(path)
+    results = dict()
+    for name, func in [("old", old_path), ("new", new_path)]:
+        sec, results[name] = timeit(func, raw, repeat)
+        print(f"{name}: {sec * 1000:.1f} ms ({len(raw) / sec:,.0f} rows/sec)")
+    print(f"same result: {aligned(results['old']).equals(aligned(results['new']))}")
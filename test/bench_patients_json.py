@@ -0,0 +1,86 @@
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from prepro_data import _parse_patients
+
+"""
+    patients.json の読み込みを、json.loads で全体を読む方法と json_stream で1件ずつ読む方法で比べる
+    data/kyoto_covid2.csv の日付と年代から同じ形の patients.json を作り、件数を増やして計測する
+    メモリは tracemalloc で計るので、Python のオブジェクトと numpy の配列の分（入力の文字列は含まない）
+    使い方: python bench_patients_json.py [件数 ...]
+"""
+
+
+def make_json(rows: int, seed: int = 0, nested: bool = False) -> str:
+    """
+    stop-covid19-kyoto の patients.json と同じ形の JSON を作る（足りない件数は繰り返す）
+    nested なら、data の前に入れ子の "data" キーと、"data": [ を含む文字列を置く
+    """
+    path = os.path.join(os.path.dirname(__file__), "..", "data", "kyoto_covid2.csv")
+    df = pd.read_csv(path).dropna()
+    df = df.iloc[np.arange(rows) % len(df)]
+    rng = np.random.default_rng(seed)
+    sex = rng.choice(["男性", "女性"], rows)
+    place = rng.choice(["京都市", "宇治市", "亀岡市", "京田辺市"], rows)
+    discharged = rng.choice(["〇", None], rows)
+    data = [
+        {
+            "No": i + 1,
+            "リリース日": f"{d}T08:00:00.000Z",
+            "居住地": p,
+            "年代と性別": f"{a}{s}",
+            "退院": o,
+            "date": d,
+        }
+        for i, (d, a, s, p, o) in enumerate(zip(df["date"], df["age"], sex, place, discharged))
+    ]
+    res = {"date": "2021/06/01 20:00", "data": data}
+    if nested:
+        res = {"meta": {"data": [1, 2]}, "note": '"data": [3]', **res}
+    return json.dumps(res, ensure_ascii=False)
+
+
+def old_path(text: str) -> pd.DataFrame:
+    res = json.loads(text)
+    df = pd.DataFrame(res["data"])
+    df["date"] = df["リリース日"].map(lambda x: x.split("T")[0])
+    df["date"] = pd.to_datetime(df["date"])
+    return df
+
+
+def measure(func, text: str):
+    start = time.perf_counter()
+    func(text)
+    sec = time.perf_counter() - start
+    tracemalloc.start()
+    result = func(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return sec, peak, result
+
+
+def same_result(old: pd.DataFrame, new: pd.DataFrame) -> bool:
+    return old.to_csv(index=None) == new.to_csv(index=None) and old["date"].equals(new["date"])
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [10_000, 100_000, 500_000]
+    text = make_json(1000, nested=True)
+    print(f"nested data key: same result: {same_result(old_path(text), _parse_patients(text))}")
+    for rows in sizes:
+        text = make_json(rows)
+        print(f"{rows:,} rows ({len(text.encode('utf-8')) / 1024 / 1024:,.1f} MB)")
+        results = dict()
+        for label, func in [("json.loads", old_path), ("json_stream", _parse_patients)]:
+            sec, peak, results[label] = measure(func, text)
+            print(f"  {label}: {sec * 1000:,.0f} ms / peak {peak / 1024 / 1024:,.1f} MB")
+        old, new = results["json.loads"], results["json_stream"]
+        print(f"  same result: {same_result(old, new)}")
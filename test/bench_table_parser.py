@@ -0,0 +1,114 @@
+import glob
+import itertools
+import os
+import sys
+import time
+import tracemalloc
+from io import StringIO
+
+import lxml.html
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from case_table import parse_case_page
+
+"""
+    京都府のページのテーブルの読み込みを、pd.read_html と case_table.parse_case_page で比べる
+    保存したページ（hassei*.html）のディレクトリを指定すればそれを使い、
+    指定しなければ data/kyoto_covid2.csv から同じ形のページ（rowspan, colspan のあるものを含む）を作って計測する
+    メモリは tracemalloc で計るので、Python のオブジェクトの分だけ（lxml 内部の分は含まない）
+    使い方: python bench_table_parser.py [保存したページのディレクトリ] [繰り返し回数]
+"""
+
+
+def make_page(rows: int, seed: int = 0, spans: bool = False) -> str:
+    """
+    1-50のページと同じ形（h3、発表のテーブル、感染者のテーブル）のページを作る
+    spans なら同じ発表日の行を rowspan でまとめ、一部の行の年代と性別を colspan でまとめる
+    """
+    path = os.path.join(os.path.dirname(__file__), "..", "data", "kyoto_covid2.csv")
+    df = pd.read_csv(path, parse_dates=["date"]).dropna().tail(rows)
+    rng = np.random.default_rng(seed)
+    cells = list()
+    previous = None
+    dates = list(df["date"])
+    for i, (d, a, s) in enumerate(
+        zip(dates, df["age"], rng.choice(["男性", "女性"], len(df)))
+    ):
+        row = f"<td>{len(df) - i}</td>"
+        if not spans:
+            row += f"<td>令和{d.year - 2018}年{d.month}月{d.day}日</td>"
+        elif d != previous:
+            span = sum(1 for _ in itertools.takewhile(lambda x: x == d, dates[i:]))
+            row += f'<td rowspan="{span}">令和{d.year - 2018}年{d.month}月{d.day}日</td>'
+        previous = d
+        if spans and i % 7 == 3:
+            row += '<td colspan="2">調査中</td>'
+        else:
+            row += f"<td>{str(a).replace('代', '')}</td><td>{s}</td>"
+        cells.append(f"<tr>{row}<td>京都市</td></tr>")
+    body = "".join(cells)
+    latest = df["date"].max()
+    return (
+        "<html><head><title>hassei</title></head><body>"
+        f"<h3>{latest.month}月{latest.day}日　発表分</h3>"
+        f"<table><tr><th>発表日</th><th>感染者数</th></tr><tr><td>{latest.month}月{latest.day}日</td>"
+        f"<td>{(df['date'] == latest).sum()}名</td></tr></table>"
+        "<table><tr><th></th><th>発表日</th><th>年代</th><th>性別</th><th>居住地</th></tr>"
+        f"{body}</table>"
+        "<div>" + "<p>関連リンク</p>" * 200 + "</div>"
+        "</body></html>"
+    )
+
+
+def old_path(text: str) -> pd.DataFrame:
+    heading = lxml.html.fromstring(text).xpath("//h3")[0].text_content()
+    tables = pd.read_html(StringIO(text))
+    return heading, tables[0], tables[1]
+
+
+def new_path(text: str) -> pd.DataFrame:
+    page = parse_case_page(text, (0, 1), need_heading=True)
+    return page.heading, page.tables[0], page.tables[1]
+
+
+def measure(func, text: str, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    result = func(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+if __name__ == "__main__":
+    page_dir = sys.argv[1] if len(sys.argv) > 1 and os.path.isdir(sys.argv[1]) else None
+    repeat = int(sys.argv[-1]) if len(sys.argv) > 1 and sys.argv[-1].isdigit() else 3
+    if page_dir is not None:
+        pages = {
+            os.path.basename(p): open(p, encoding="utf-8").read()
+            for p in sorted(glob.glob(os.path.join(page_dir, "hassei1-50.html")))
+        }
+    else:
+        pages = {f"synthetic-{rows}": make_page(rows) for rows in [50, 1000, 10000]}
+        pages.update(
+            {f"synthetic-spans-{rows}": make_page(rows, spans=True) for rows in [50, 1000]}
+        )
+
+    for name, text in pages.items():
+        print(f"{name} ({len(text) / 1024:,.0f} KB)")
+        results = dict()
+        for label, func in [("read_html", old_path), ("case_table", new_path)]:
+            sec, peak, results[label] = measure(func, text, repeat)
+            print(f"  {label}: {sec * 1000:.1f} ms / peak {peak / 1024 / 1024:.1f} MB")
+        old, new = results["read_html"], results["case_table"]
+        same = old[0].strip() == new[0] and all(
+            o.astype(str).equals(n.astype(str)) for o, n in zip(old[1:], new[1:])
+        )
+        print(f"  same result: {same}")
@@ -0,0 +1,215 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+os.chdir(ROOT)
+
+from aggregate import CountCube, LevelOfDetail
+from analytics import RollingStats
+from data_store import DataStore
+from snapshot import load_snapshot, snapshot_path, write_snapshot
+
+"""
+    データの読み込み、集計、グラフ作成、各コールバックの処理時間を計測する
+    data/kyoto_covid2.csv と同じ日付・年代の分布で、行数を scale 倍した合成データを使う
+
+    使い方:
+        python test/benchmark.py --scales 1,10,100 --output bench.json
+        python test/benchmark.py --compare bench.json   # 前回の結果と比べる
+    --compare では threshold 倍より遅くなった項目があれば終了コード 1 を返す
+"""
+
+# app は import 時にデータを読み込むので、合成データを作ってから import する
+app = None
+
+
+def make_dataset(scale: int, out_dir: str, seed: int = 0) -> str:
+    """
+    kyoto_covid2.csv の (date, age) の組み合わせから、scale 倍の行数を復元抽出して保存する
+    """
+    base = pd.read_csv("data/kyoto_covid2.csv", parse_dates=["date"])
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(base), len(base) * scale)
+    df = base.iloc[np.sort(rows)].reset_index(drop=True)
+    df["sex"] = rng.choice(["男性", "女性"], len(df))
+    path = os.path.join(out_dir, f"patients_x{scale}.csv")
+    df.to_csv(path)
+    write_snapshot(df, path)
+    return path
+
+
+def measure(func, repeat: int, setup=None) -> dict:
+    times = list()
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        "best_ms": min(times) * 1000,
+        "mean_ms": sum(times) / len(times) * 1000,
+        "repeat": repeat,
+    }
+
+
+def cases(path: str):
+    """
+    (名前, 計測する関数, 前処理) のリスト
+    """
+    df = pd.read_csv(path, parse_dates=["date"], index_col=0)
+    cube = CountCube.from_frame(df)
+    new_date = cube.max_date
+    counts, total = app.cal_counts(cube, new_date)
+    stats = RollingStats.from_cube(cube)
+    all_df = cube.all_frame()
+    aged_df = cube.aged_frame()
+    sel_df = aged_df[aged_df["age"].isin(["10代未満", "10代"])].sort_values("date")
+
+    store = DataStore(path, app.build_patient_data)
+    date_str = new_date.strftime("%Y-%m-%d")
+
+    def use_store():
+        app.store = store
+
+    def cold():
+        use_store()
+        app.figure_cache.clear()
+
+    update_circle = getattr(app.update_circle, "__wrapped__", app.update_circle)
+    update_seshu = getattr(
+        app.update_seshu_graph, "__wrapped__", app.update_seshu_graph
+    )
+    update_total = getattr(
+        app.update_total_detail, "__wrapped__", app.update_total_detail
+    )
+    update_aged = getattr(app.update_aged_detail, "__wrapped__", app.update_aged_detail)
+    # 直近90日に拡大した時の relayoutData
+    relayout = {
+        "xaxis.range[0]": (new_date - pd.Timedelta(days=90)).strftime("%Y-%m-%d"),
+        "xaxis.range[1]": date_str,
+    }
+
+    return [
+        ("load_csv", lambda: pd.read_csv(path, parse_dates=["date"], index_col=0), None),
+        (
+            "load_snapshot",
+            lambda: CountCube.from_snapshot(
+                load_snapshot(snapshot_path(path), csv_path=path)
+            ),
+            None,
+        ),
+        ("build_cube", lambda: CountCube.from_frame(df), None),
+        ("cal_counts", lambda: app.cal_counts(cube, new_date), None),
+        (
+            "cal_range_counts",
+            lambda: app.cal_range_counts(cube, stats, cube.min_date, new_date),
+            None,
+        ),
+        ("aged_df", cube.aged_frame, None),
+        ("all_df", cube.all_frame, None),
+        ("aged_lod", lambda: LevelOfDetail(cube.counts), None),
+        ("rolling_stats", lambda: RollingStats.from_cube(cube), None),
+        ("build_patient_data", lambda: app.build_patient_data(path, "bench"), None),
+        ("draw_circle", lambda: app.draw_circle(counts, total, new_date), None),
+        ("draw_line_total", lambda: app.draw_line(all_df, color=None), None),
+        ("draw_line_aged", lambda: app.draw_line(sel_df), None),
+        (
+            "recent_pcr_graph",
+            lambda: app.recent_pcr_graph(
+                app.vaccine_store.current.seshu_data,
+                x_axis_name="年代",
+                y_axis_name="2回目接種率",
+                latest=app.vaccine_store.current.seshu_latest,
+            ),
+            None,
+        ),
+        ("update_circle_cold", lambda: update_circle(date_str), cold),
+        ("update_circle_warm", lambda: update_circle(date_str), use_store),
+        ("update_seshu_graph", lambda: update_seshu("2回目接種率"), None),
+        ("update_total_detail_cold", lambda: update_total(relayout), cold),
+        ("update_total_detail_warm", lambda: update_total(relayout), use_store),
+        (
+            "update_aged_detail",
+            lambda: update_aged(relayout, ["10代未満", "10代", "20代"]),
+            use_store,
+        ),
+    ]
+
+
+def run(scales, repeat: int) -> dict:
+    global app
+    results = list()
+    with tempfile.TemporaryDirectory() as out_dir:
+        for scale in scales:
+            path = make_dataset(scale, out_dir)
+            if app is None:
+                os.environ.setdefault("DATA_PATH", path)
+                app = importlib.import_module("app")
+            rows = sum(1 for _ in open(path, encoding="utf-8")) - 1
+            for name, func, setup in cases(path):
+                result = measure(func, repeat, setup)
+                result.update({"name": name, "scale": scale, "rows": rows})
+                results.append(result)
+                print(f"x{scale:<4} {name:<26} {result['best_ms']:10.2f} ms")
+    return {
+        "meta": {
+            "created": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> bool:
+    """
+    baseline と比べて threshold 倍より遅くなった項目があれば False を返す
+    """
+    base = {(r["name"], r["scale"]): r for r in baseline["results"]}
+    ok = True
+    for r in report["results"]:
+        old = base.get((r["name"], r["scale"]))
+        if old is None:
+            continue
+        ratio = r["best_ms"] / old["best_ms"] if old["best_ms"] else float("inf")
+        mark = "REGRESSION" if ratio > threshold else ""
+        ok = ok and ratio <= threshold
+        print(
+            f"x{r['scale']:<4} {r['name']:<26} {old['best_ms']:10.2f} -> "
+            f"{r['best_ms']:10.2f} ms ({ratio:5.2f}x) {mark}"
+        )
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", default="1,10")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    parser.add_argument("--compare", help="比較する以前の結果のJSONファイル")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args()
+
+    report = run([int(s) for s in args.scales.split(",")], args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.threshold):
+            sys.exit(1)
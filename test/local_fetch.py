@@ -0,0 +1,38 @@
+import os
+import sys
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import chomoku_get
+from fetcher import Fetcher
+
+"""
+    保存した京都府のページ（hassei-bn.html, hassei{N}.html, hassei1-50.html）を
+    ローカルのサーバーで配信して get_data を実行する
+    使い方: python local_fetch.py 保存したページのディレクトリ [バックナンバーの数]
+"""
+
+
+def serve(page_dir: str) -> ThreadingHTTPServer:
+    handler = partial(SimpleHTTPRequestHandler, directory=page_dir)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+if __name__ == "__main__":
+    page_dir = sys.argv[1]
+    selected_num = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    httpd = serve(page_dir)
+    chomoku_get.BASE_URL = f"http://127.0.0.1:{httpd.server_port}/"
+
+    fetcher = Fetcher(concurrency=4, rate=20, burst=4, backoff=0.1)
+    start = time.perf_counter()
+    data = chomoku_get.get_data(selected_num, fetcher)
+    print(f"{len(data)} rows / {time.perf_counter() - start:.2f} sec")
+    print(data.tail())
+    httpd.shutdown()
@@ -0,0 +1,46 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import ingest
+from fixtures import fixture_url, serve
+from page_cache import PageCache
+
+"""
+    記録したページ（fixtures.py）を使って、ネットワークなしで取り込み全体を実行し時間を計る
+    一時ディレクトリにバンドルとページのキャッシュを作るので、data/ のファイルは変わらない
+    （月ごとのCSVもバンドルの中に書く）
+    使い方: python replay_ingest.py [記録のディレクトリ] [--record] [--delay-ms N]
+    先に --record を付けて一度実行すると、ネットワークから取得したページを記録する
+"""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("fixture_dir", nargs="?", default=os.path.join("data", "fixtures"))
+    parser.add_argument("--record", action="store_true")
+    parser.add_argument("--delay-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    server = serve(args.fixture_dir, port=0, record=args.record, delay=args.delay_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["FETCH_FIXTURE_URL"] = fixture_url(server)
+    os.environ.setdefault("FETCH_RATE", "100")
+
+    with tempfile.TemporaryDirectory() as work:
+        root = os.path.join(work, "bundles")
+        cache = PageCache(os.path.join(work, "page_cache"))
+        session = requests.Session()
+        for run in ["cold", "warm"]:
+            sources = ingest.make_sources(session, cache)
+            start = time.perf_counter()
+            version = ingest.run(sources, root)
+            print(f"{run}: {time.perf_counter() - start:.2f} sec (published: {version})")
+    server.shutdown()
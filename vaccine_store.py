@@ -0,0 +1,185 @@
+import json
+import os
+from io import StringIO
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+"""
+    ワクチンの接種数、配送数のデータを、取得した日（スナップショット）ごとにCSVへ追記して保存する
+    すでに保存している日付のスナップショットは追記しない
+    <CSV>.index.json には日付ごとの行の範囲とバイトの範囲を持ち、最新のスナップショットだけを読み込める
+"""
+
+## 接種数（data/vaccined_num.csv）の列の型
+SESHU_DTYPES = {
+    "年代": "category",
+    "1回目接種数": "int64",
+    "1回目接種率": "float32",
+    "2回目接種数": "int64",
+    "2回目接種率": "float32",
+}
+
+## 配送数（data/vac_forecast.csv）の列の型
+FORECAST_DTYPES = {
+    "配送期間": "category",
+    "配送数（予定を含む）": "int64",
+}
+
+
+class VaccineTable:
+    """
+    日付ごとのスナップショットを追記していくCSV
+
+    Params:
+        path: CSVへのパス
+        dtypes: date 以外の列の型（category の列は最初に出てきた順をカテゴリの順にする）
+    """
+
+    def __init__(self, path: str, dtypes: Dict[str, str]):
+        self.path = path
+        self.dtypes = dtypes
+        self.index = self._load_index()
+
+    @property
+    def index_path(self) -> str:
+        return f"{self.path}.index.json"
+
+    def _file_size(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def _load_index(self) -> Dict:
+        """
+        保存してある索引を読み込む。CSVのサイズが変わっていれば作り直す
+        """
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index["size"] == self._file_size():
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+        index = self._build_index()
+        self._save_index(index)
+        return index
+
+    def _build_index(self) -> Dict:
+        """
+        CSVを一度読んで、日付ごとの行の範囲とバイトの範囲を作る
+        同じ日付が離れて出てくる場合は最初のものだけを使う
+        """
+        index = {"size": self._file_size(), "header": None, "rows": 0, "snapshots": {}}
+        if index["size"] == 0:
+            return index
+        with open(self.path, "rb") as f:
+            lines = f.readlines()
+        index["header"] = lines[0].decode("utf-8")
+        index["rows"] = len(lines) - 1
+        dates = pd.read_csv(self.path, usecols=["date"], dtype=str)["date"]
+        offset = len(lines[0])
+        previous, span = None, None
+        for row, (date, line) in enumerate(zip(dates, lines[1:])):
+            if date != previous:
+                span = None
+                if date not in index["snapshots"]:
+                    span = index["snapshots"][date] = [row, row, offset, offset]
+            if span is not None:
+                span[1], span[3] = row + 1, offset + len(line)
+            previous = date
+            offset += len(line)
+        return index
+
+    def _save_index(self, index: Dict) -> None:
+        tmp_path = f"{self.index_path}.tmp-{os.getpid()}"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(index, f, ensure_ascii=False, sort_keys=True)
+            os.replace(tmp_path, self.index_path)
+        except OSError:  # 書き込めない場所でも読み込みはできるようにする
+            pass
+
+    @property
+    def dates(self) -> List[str]:
+        return sorted(self.index["snapshots"])
+
+    @property
+    def latest_date(self) -> Optional[str]:
+        dates = self.dates
+        return dates[-1] if dates else None
+
+    def _typed(self, df: pd.DataFrame) -> pd.DataFrame:
+        df = df.copy()
+        for col, dtype in self.dtypes.items():
+            if dtype == "category":
+                df[col] = pd.Categorical(df[col], categories=pd.unique(df[col]))
+            else:
+                df[col] = df[col].astype(dtype)
+        df["date"] = pd.to_datetime(df["date"])
+        return df
+
+    def append(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        まだ保存していない日付のスナップショットだけを追記する
+        Params:
+            df: dtypes の列と date 列を持つデータフレーム
+        Returns:
+            new_rows: 追記した行
+        """
+        df = df.copy()
+        df["date"] = pd.to_datetime(df["date"]).dt.strftime("%Y-%m-%d")
+        new_rows = df[~df["date"].isin(self.index["snapshots"])]
+        if new_rows.empty:
+            return new_rows
+        new_rows = new_rows.sort_values("date", kind="stable")
+        columns = list(self.dtypes) + ["date"]
+        new_rows = new_rows[columns]
+
+        exists = self.index["size"] > 0
+        offset = self.index["size"]
+        if not exists:
+            header = ",".join(columns) + "\n"
+            self.index["header"] = header
+            offset = len(header.encode("utf-8"))
+        row = self.index["rows"]
+        chunks = list()
+        for date, part in new_rows.groupby("date", sort=True):
+            chunk = part.to_csv(header=False, index=False).encode("utf-8")
+            self.index["snapshots"][date] = [row, row + len(part), offset, offset + len(chunk)]
+            row += len(part)
+            offset += len(chunk)
+            chunks.append(chunk)
+
+        with open(self.path, "ab") as f:
+            if not exists:
+                f.write(self.index["header"].encode("utf-8"))
+            f.write(b"".join(chunks))
+        self.index["size"] = self._file_size()
+        self.index["rows"] = row
+        self._save_index(self.index)
+        return new_rows
+
+    def snapshot(self, date: Optional[str] = None) -> pd.DataFrame:
+        """
+        date（省略すると最新）のスナップショットだけを、索引のバイトの範囲から読み込む
+        """
+        date = date or self.latest_date
+        if date is None or date not in self.index["snapshots"]:
+            return self._typed(pd.DataFrame(columns=list(self.dtypes) + ["date"]))
+        _, _, start, end = self.index["snapshots"][date]
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            body = f.read(end - start).decode("utf-8")
+        return self._typed(pd.read_csv(StringIO(self.index["header"] + body)))
+
+    def load(self) -> pd.DataFrame:
+        """
+        全てのスナップショット（日付の重複は除く）を読み込む
+        """
+        if not self.index["snapshots"]:
+            return self.snapshot()
+        df = pd.read_csv(self.path)
+        rows = [
+            range(start, end) for start, end, _, _ in self.index["snapshots"].values()
+        ]
+        keep = sorted(i for span in rows for i in span)
+        return self._typed(df.iloc[keep].reset_index(drop=True))